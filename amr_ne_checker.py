@@ -17,17 +17,57 @@ import os
 import sys
 import re
 import csv
+import json
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from itertools import islice
 
+import numpy as np
 from zhon import hanzi  # for Chinese regex
 
 sys.path.append('./camr/')
 from amr import AMR
-from smatch import get_amr_line
-from preprocess import read_amrz
+from amr_corpus import get_amr, iter_amrz_mapped, record_id
+from amr_cache import load_parsed_amrs
+from significance import column_total, compare_all, f_score
+from util import Alphabet
 
 # Folder with the AMR data
 DATA_DIR = os.path.join(os.curdir, 'data')
 
+# Number of worker processes for NE evaluation (1 = evaluate serially)
+WORKERS = 1
+
+# Number of sentences handed to a worker process at a time
+SHARD_SIZE = 256
+
+# Number of shards queued for the workers at a time
+MAX_PENDING_SHARDS = 64
+
+# Number of parsed AMRs that may arrive ahead of their gold sentence before
+# the gold sentence is taken to have no parse (see align_by_id)
+ALIGN_WINDOW = 256
+
+# Number of paired bootstrap samples for the significance of the differences
+# between systems in evaluate_systems (0 = no significance testing)
+BOOTSTRAP_SAMPLES = 0
+
+# Seed of the bootstrap samples, so reports are repeatable
+BOOTSTRAP_SEED = 1
+
+# Number of NE tags shown in the per-type P/R/F1 table of each system in
+# evaluate_systems, most frequent gold tags first (0 = no table)
+TYPE_REPORT_ROWS = 10
+
+# Folder to save the per-type scores and confusion matrix of each system to,
+# as CSV and JSON (None = don't save them)
+TYPE_SCORES_DIR = None
+
+# Whether to keep the parsed gold AMRs in the on-disk cache of camr/amr_cache.py
+# (run `python camr/amr_cache.py --clear` after changing the AMR parser)
+USE_AMR_CACHE = False
+
 # Dictionary of Chinese NE tags and their English equivalents
 CHINESE_ENTITIES = os.path.join(DATA_DIR, "chinese_entities.csv")
 
@@ -65,44 +105,339 @@ with open(CHINESE_ENTITIES) as source:
     for row in reader:
         zh_ne_dict[row['Chinese']] = row['English']
 
+# NE tags and what normalize_entity renames them to: the Chinese tags and
+# the typos in the English ones (which take precedence)
+ne_typo_dict = {"coountry": "country", "peson": "person"}
+ne_normalization_dict = dict(zh_ne_dict)
+ne_normalization_dict.update(ne_typo_dict)
+
+# What preprocess_nes rewrites: the comment lines it keeps as they are, and
+# in the other lines each maximal run of Chinese characters and each typo
+# that is a whole concept (after "/ ", so not "peson-01" or a quoted name)
+PREPROCESS_NES_RE = re.compile(
+    r"^#.*|[{}]+|(?<=/ )(?:{})(?![^\s()])".format(
+        hanzi.characters, "|".join(map(re.escape, ne_typo_dict))),
+    re.MULTILINE)
+
 def normalize_entity(entity):
     """Rename Chinese named entities to English"""
-    if entity in ["coountry", "country"]: return "country"
-    elif entity in ["peson"]: return "person"
-    elif entity in zh_ne_dict.keys():
-        return zh_ne_dict[entity]
-    #elif len(re.findall("[{}]".format(hanzi.characters), entity)) > 0:
+    #if len(re.findall("[{}]".format(hanzi.characters), entity)) > 0:
         #return "OtherChineseWord"
-    else:
-        return entity
+    return ne_normalization_dict.get(entity, entity)
+
+def _normalize_match(match):
+    """Replacement of a PREPROCESS_NES_RE match"""
+    text = match.group()
+    if text.startswith("#"):
+        return text
+    return ne_normalization_dict.get(text, text)
 
-def preprocess_nes(source_fname, dest_fname):
+def _preprocess_shard(lines):
+    """Normalize the NE tags of a shard of lines of an AMR file"""
+    return PREPROCESS_NES_RE.sub(_normalize_match, "".join(lines))
+
+def preprocess_nes(source_fname, dest_fname, workers=None):
     """Preprocess AMRs by normalizing entity names
+    The file is streamed in shards of lines, which are normalized in a
+    single regex pass each.
     Inputs:
         source_fname: source AMR file
         dest_fname: name of file to save to
+        workers: number of worker processes (1 = preprocess serially;
+            None = WORKERS)
     """
-    rephrased_ids = set()
-    rephrased_snt = None
-    current_id = None
-    with open(source_fname) as source:
-        with open(dest_fname,'w') as dest:
-            for line in source:
-                if line.startswith("# ::id"):
-                    current_id = line
-                    dest.write(line)
-                elif line.startswith("# ::snt"):
-                    dest.write(line)
-                elif line.startswith("# ::wid"):
-                    dest.write(line)
-                else:  # the amr graph
-                    # Normalize the Chinese NE tags
-                    line = re.sub(
-                        r"[{}]+".format(hanzi.characters),
-                        lambda x:normalize_entity(x.group()),
-                        line
-                    )
-                    dest.write(line)
+    if workers is None:
+        workers = WORKERS
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        with open(source_fname) as source:
+            with open(dest_fname,'w') as dest:
+                for text in _map_shards(
+                        pool, _preprocess_shard, _shards(source)):
+                    dest.write(text)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+# Tokens of a one-line AMR for extract_name_edges: quoted strings,
+# parentheses, slashes, :relations and other (variable or constant) tokens
+AMR_TOKEN_RE = re.compile(r'"[^"]*"|[()/]|:[^\s()"/]*|[^\s()"/:][^\s()"/]*')
+
+class MalformedAMR(Exception):
+    """An AMR that extract_name_edges leaves to the full AMR parser"""
+
+def _amr_edges(amr):
+    """Read the concepts and edges of a one-line AMR in a single pass
+    Inputs:
+        amr: AMR string (one-line form)
+    Returns:
+        concepts: dict of variable to concept, in the order of the variables
+        edges: list of (source variable, relation, variable or constant);
+            as in AMR, edges to a variable that is only defined later come
+            after the others
+    Raises:
+        MalformedAMR if the AMR is not a single well-formed graph
+    """
+    tokens = AMR_TOKEN_RE.findall(amr)
+    concepts = dict()
+    edges = list()
+    later_edges = list()
+    stack = list()
+    relation = None
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == "(":
+            # (variable / concept
+            if i + 3 >= len(tokens) or tokens[i + 2] != "/":
+                raise MalformedAMR(amr)
+            variable = tokens[i + 1]
+            if variable in concepts or (relation is None) != (not stack):
+                raise MalformedAMR(amr)
+            if stack:
+                edges.append((stack[-1], relation, variable))
+            elif concepts:
+                raise MalformedAMR(amr)
+            concepts[variable] = tokens[i + 3]
+            stack.append(variable)
+            relation = None
+            i += 4
+            continue
+        if not stack or token == "/":
+            raise MalformedAMR(amr)
+        if token == ")":
+            if relation is not None:
+                raise MalformedAMR(amr)
+            stack.pop()
+        elif token[0] == ":":
+            if relation is not None:
+                raise MalformedAMR(amr)
+            relation = token[1:]
+        else:
+            if relation is None:
+                raise MalformedAMR(amr)
+            if token in concepts:
+                edges.append((stack[-1], relation, token))
+            else:
+                later_edges.append((stack[-1], relation, token))
+            relation = None
+        i += 1
+    if stack or not concepts:
+        raise MalformedAMR(amr)
+    edges.extend(later_edges)
+    return concepts, edges
+
+def extract_name_edges(amr):
+    """Get the named entities of one AMR straight from its text, without
+    building an AMR object
+    Gives the same entities in the same order as graph_name_edges does on
+    AMR.parse_AMR_line_fast(amr), which it falls back to for AMRs it can't
+    read (check_name_edges.py checks this on the AMRs in data/).
+    Inputs:
+        amr: AMR string (one-line form)
+    Returns:
+        list of (NE tag, name strings, variable of the entity, variable of
+        its name node or None if the name is a string)
+    """
+    if ":name" not in amr:
+        return []
+    try:
+        concepts, edges = _amr_edges(amr)
+    except MalformedAMR:
+        return graph_name_edges(AMR.parse_AMR_line_fast(amr))
+    # As in AMR: a node keeps one value per attribute and one relation per
+    # other node (the last one given), and the attributes come first
+    attributes = dict()
+    relations = dict()
+    for source, relation, target in edges:
+        if target[0] == '"':
+            attributes[source, relation] = target[1:-1]
+        elif target not in concepts:
+            attributes[source, relation] = target
+        elif relation.endswith("-of"):
+            relations[target, source] = relation[:-3]
+        else:
+            relations[source, target] = relation
+    names = dict()
+    for (source, relation), value in attributes.items():
+        if relation.startswith("op"):
+            names.setdefault(source, []).append(value)
+    order = {variable: i for i, variable in enumerate(concepts)}
+    entities = sorted(
+        ((order[source], concepts[source], (value,), source, None)
+         for (source, relation), value in attributes.items()
+         if relation == "name"), key=lambda e: e[0])
+    entities.extend(sorted(
+        ((order[source], concepts[source], tuple(names.get(target, ())),
+          source, target)
+         for (source, target), relation in relations.items()
+         if relation == "name"), key=lambda e: e[0]))
+    return [entity[1:] for entity in entities]
+
+def get_named_entities(amr):
+    """Get the NE tags of one AMR
+    Inputs:
+        amr: AMR string (one-line form)
+    Returns:
+        list of NE tags, in the order their :name edges are found
+    """
+    return [entity[0] for entity in extract_name_edges(amr)]
+
+def graph_name_edges(amr_graph):
+    """Get the named entities of one AMR that is already parsed
+    Inputs:
+        amr_graph: AMR object
+    Returns:
+        list of (NE tag, name strings, variable of the entity, variable of
+        its name node or None), in the order their :name edges are found
+    """
+    # variable to concept graph (from Damonte & Cohen)
+    v2c = {}
+    # variable to the :op values of the node (the strings of a name node)
+    names = {}
+    for n, v, attributes in zip(amr_graph.nodes, amr_graph.node_values,
+                                amr_graph.attributes):
+        v2c[n] = v
+        # the AMR parsers end a quoted string with "_"
+        names[n] = tuple(value[:-1] if value.endswith("_") else value
+                         for relation, value in attributes.items()
+                         if relation.startswith("op"))
+    # relation, arg1, arg2 triples (from Damonte & Cohen)
+    # e.g. (name, v1, v2) means "v1 is name of v2"
+    instance_triples, attribute_triples, relation_triples = \
+        amr_graph.get_triples()
+    entities = [(str(v2c[v1]), (v2[:-1] if v2.endswith("_") else v2,), v1,
+                 None)
+                for (l, v1, v2) in attribute_triples if l == "name"]
+    entities.extend((str(v2c[v1]), names.get(v2, ()), v1, v2)
+                    for (l, v1, v2) in relation_triples if l == "name")
+    return entities
+
+def graph_named_entities(amr_graph):
+    """Get the NE tags of one AMR that is already parsed
+    Inputs:
+        amr_graph: AMR object
+    Returns:
+        list of NE tags, in the order their :name edges are found
+    """
+    return [entity[0] for entity in graph_name_edges(amr_graph)]
+
+def token_span(variable):
+    """Get the tokens a variable is aligned to, e.g. (19, 22) for
+    x19_x20_x21_x22 or (3, 3) for x3
+    Inputs:
+        variable: AMR variable
+    Returns:
+        (first, last) token number, or None if the variable is not aligned
+    """
+    if variable is None:
+        return None
+    tokens = list()
+    for part in variable.split("_"):
+        if part[:1] != "x" or not part[1:].isdigit():
+            return None
+        tokens.append(int(part[1:]))
+    return min(tokens), max(tokens)
+
+def entity_spans(entities, postprocessing=False):
+    """Get the (NE tag, surface string, token span) of named entities
+    Inputs:
+        entities: list of named entities from extract_name_edges
+        postprocessing: whether to normalize NE tags
+    Returns:
+        list of (NE tag, name strings joined by spaces, token span of the
+        name node or None), in the same order
+    """
+    spans = list()
+    for entity_type, names, _, name_variable in entities:
+        if postprocessing is True:
+            entity_type = normalize_entity(entity_type)
+        spans.append((entity_type, " ".join(names), token_span(name_variable)))
+    return spans
+
+class SpanIndex(object):
+    """The parsed entities of a sentence that are still unmatched, found by
+    overlapping token span or, where a span is unknown, by surface string.
+    The spans are sorted by their first token, so the ones that can overlap
+    a given span are a bisect range of at most the longest span back."""
+
+    def __init__(self, spans):
+        """
+        Inputs:
+            spans: list of (NE tag, surface string, token span or None)
+        """
+        self.spans = spans
+        self.used = [False] * len(spans)
+        self.sorted = sorted((span[2][0], i) for i, span in enumerate(spans)
+                             if span[2] is not None)
+        self.starts = [start for start, _ in self.sorted]
+        self.longest = max([span[2][1] - span[2][0] for span in spans
+                            if span[2] is not None] or [0])
+        self.by_surface = dict()
+        for i, (entity_type, surface, _) in enumerate(spans):
+            self.by_surface.setdefault((entity_type, surface), []).append(i)
+
+    def overlapping(self, token_span):
+        """Indices of the spans that overlap token_span"""
+        first, last = token_span
+        low = bisect_left(self.starts, first - self.longest)
+        high = bisect_right(self.starts, last)
+        return [i for _, i in self.sorted[low:high]
+                if self.spans[i][2][1] >= first]
+
+    def take(self, span):
+        """Mark the unused entity that best matches span as used
+        Inputs:
+            span: (NE tag, surface string, token span or None)
+        Returns:
+            whether there was one: of the same NE tag, and with a token span
+            overlapping span's, or the same surface string if either span
+            is unknown
+        """
+        entity_type, surface, token_span = span
+        best = None
+        if token_span is not None:
+            most = 0
+            for i in self.overlapping(token_span):
+                if self.used[i] or self.spans[i][0] != entity_type:
+                    continue
+                start, end = self.spans[i][2]
+                overlap = min(end, token_span[1]) - max(start, token_span[0])
+                if best is None or overlap > most:
+                    best, most = i, overlap
+        if best is None:
+            for i in self.by_surface.get((entity_type, surface), ()):
+                if not self.used[i] and (token_span is None or
+                                         self.spans[i][2] is None):
+                    best = i
+                    break
+        if best is None:
+            return False
+        self.used[best] = True
+        return True
+
+def match_spans(gold_spans, parsed_spans):
+    """Match the named entities of one sentence by span
+    Inputs:
+        gold_spans, parsed_spans: lists from entity_spans
+    Returns:
+        (exact, partial): the number of parsed entities equal to a gold one,
+        and of the others that overlap an unmatched gold one (see
+        SpanIndex.take), each matched at most once
+    """
+    if not gold_spans or not parsed_spans:
+        return 0, 0
+    exact = Counter(gold_spans) & Counter(parsed_spans)
+    gold_rest = list((Counter(gold_spans) - exact).elements())
+    parsed_rest = list((Counter(parsed_spans) - exact).elements())
+    partial = 0
+    if gold_rest and parsed_rest:
+        index = SpanIndex(parsed_rest)
+        for span in gold_rest:
+            if index.take(span):
+                partial += 1
+    return sum(exact.values()), partial
 
 def count_named_entities(amrs):
     """Count each NE tag
@@ -113,155 +448,641 @@ def count_named_entities(amrs):
     """
     entity_counts = dict()
     for amr in amrs:
-        amr_graph = AMR.parse_AMR_line(amr)
-        # variable to concept graph (from Damonte & Cohen)
-        v2c = {}
-        for n, v in zip(amr_graph.nodes, amr_graph.node_values):
-            v2c[n] = v
-        # relation, arg1, arg2 triples (from Damonte & Cohen)
-        # e.g. (name, v1, v2) means "v1 is name of v2"
-        # The indices are because triples() returns a list of lists
-        triples = [t for t in amr_graph.get_triples()[1]]
-        triples.extend([t for t in amr_graph.get_triples()[2]])
-        named_entities = [str(v2c[v1]) for (l,v1,v2) in triples if l == "name"]
-        for ne in named_entities:
+        for ne in get_named_entities(amr):
             entity_counts[ne] = entity_counts.get(ne, 0) + 1
     return entity_counts
 
-def evaluate_named_entities(gold_amr_file, parsed_amr_file, postprocessing=False):
+def lookup_named_entities(amr_file, amr_id, postprocessing=False):
+    """Get the NE tags of a single AMR by its ::id, without reading the
+    whole file (uses the sidecar index built by amr_corpus)
+    Inputs:
+        amr_file: AMR file to look in
+        amr_id: sentence id, e.g. export_amr.1303
+        postprocessing: whether to normalize NE tags
+    Returns:
+        (comment, amr, list of NE tags)
+    """
+    comment, amr = get_amr(amr_file, amr_id)
+    named_entities = get_named_entities(amr)
+    if postprocessing is True:
+        named_entities = [normalize_entity(e) for e in named_entities]
+    return comment, amr, named_entities
+
+# Per-sentence counts kept by NamedEntityScores, in column order
+SENTENCE_COUNT_COLUMNS = ("matched", "parsed", "gold", "extra", "missing",
+                          "mismatch", "perfect_nonempty")
+
+# Tag of the missing side of an unpaired gold or parsed NE
+NO_ENTITY = "None"
+
+class SpanScores(object):
+    """Running counts of span-level NE matches (see match_spans)"""
+
+    def __init__(self):
+        self.gold_count = 0
+        self.parsed_count = 0
+        self.exact_count = 0  # same NE tag, surface string and tokens
+        self.partial_count = 0  # same NE tag and overlapping tokens only
+
+    def add(self, gold_spans, parsed_spans):
+        """Match the entities of one sentence
+        Inputs:
+            gold_spans, parsed_spans: lists from entity_spans
+        """
+        exact, partial = match_spans(gold_spans, parsed_spans)
+        self.gold_count += len(gold_spans)
+        self.parsed_count += len(parsed_spans)
+        self.exact_count += exact
+        self.partial_count += partial
+
+    def update(self, other):
+        """Add the counts of another SpanScores"""
+        self.gold_count += other.gold_count
+        self.parsed_count += other.parsed_count
+        self.exact_count += other.exact_count
+        self.partial_count += other.partial_count
+
+    def scores(self, partial=False):
+        """Get (precision, recall, F-score) of the exact matches, or of the
+        exact and partial matches together"""
+        matched = self.exact_count
+        if partial is True:
+            matched += self.partial_count
+        precision = matched / self.parsed_count if self.parsed_count else 0.0
+        recall = matched / self.gold_count if self.gold_count else 0.0
+        f = float(f_score([matched, self.parsed_count, self.gold_count]))
+        return precision, recall, f
+
+    def report(self):
+        """Print the span precision, recall and F-scores"""
+        for name, partial in [("Exact", False), ("Partial", True)]:
+            print("{} span match P/R/F1: {:.4f} {:.4f} {:.4f}".format(
+                name, *self.scores(partial)))
+
+class NamedEntityScores(object):
+    """Running NE error counts for one gold vs parsed comparison"""
+
+    def __init__(self):
+        self.gold_entity_counts = dict()
+        self.parsed_entity_counts = dict()
+
+        # Types of NE errors
+        self.extra_ne_count = 0  # Parser has NE where gold has none
+        self.missing_ne_count = 0  # Parser lacks NE where gold has one
+        self.ne_mismatch_count = 0  # NE count matches but tags don't match
+        self.perfect_match_count = 0  # NE count matches (could be zero)
+        # NE count matches (nonzero) and tags too
+        self.perfect_match_nonempty_count = 0
+
+        # Keep track of all the entities, as pairs of a gold and a parsed tag
+        # (see add); NO_ENTITY stands in for the missing side
+        self.all_gold_entities = list()
+        self.all_parsed_entities = list()
+
+        # One row per sentence, see SENTENCE_COUNT_COLUMNS
+        self.sentence_counts = list()
+
+        # Matches of (NE tag, surface string, token span)
+        self.span_scores = SpanScores()
+
+        # Gold sentences with no parsed AMR of the same id
+        self.unmatched_gold_count = 0
+        # Parsed AMRs whose id is not in gold (or is repeated)
+        self.unmatched_parsed_count = 0
+
+    def add(self, gold_named_entities, parsed_named_entities):
+        """Score the NE tags of one sentence
+        Inputs:
+            gold_named_entities: NE tags of the gold AMR
+            parsed_named_entities: NE tags of the parsed AMR,
+                or None if there is no parsed AMR for this sentence
+        """
+        for ne in gold_named_entities:
+            self.gold_entity_counts[ne] = \
+                self.gold_entity_counts.get(ne, 0) + 1
+        if parsed_named_entities is None:
+            self.unmatched_gold_count += 1
+            self.sentence_counts.append(
+                (0, 0, len(gold_named_entities), 0, 0, 0, 0))
+            self.all_gold_entities.extend(gold_named_entities)
+            self.all_parsed_entities.extend(
+                [NO_ENTITY] * len(gold_named_entities))
+            return
+        counts = [sum((Counter(gold_named_entities) &
+                       Counter(parsed_named_entities)).values()),
+                  len(parsed_named_entities), len(gold_named_entities),
+                  0, 0, 0, 0]
+
+        for ne in parsed_named_entities:
+            self.parsed_entity_counts[ne] = \
+                self.parsed_entity_counts.get(ne, 0) + 1
+
+        # Get the various error counts
+        if len(gold_named_entities) < len(parsed_named_entities):
+            self.extra_ne_count += 1
+            counts[3] = 1
+        elif len(gold_named_entities) > len(parsed_named_entities):
+            self.missing_ne_count += 1
+            counts[4] = 1
+        elif gold_named_entities == parsed_named_entities and \
+                len(gold_named_entities) > 0:
+            self.perfect_match_nonempty_count += 1
+            counts[6] = 1
+        elif gold_named_entities == parsed_named_entities:
+            self.perfect_match_count += 1
+        else:
+            self.ne_mismatch_count += 1
+            counts[5] = 1
+        self.sentence_counts.append(tuple(counts))
+
+        # Pair the tags found in both first, then the rest in order, and
+        # if the lists of entities are different, add NO_ENTITY
+        matched = Counter(gold_named_entities) & Counter(parsed_named_entities)
+        gold_rest = list((Counter(gold_named_entities) - matched).elements())
+        parsed_rest = list(
+            (Counter(parsed_named_entities) - matched).elements())
+        while len(gold_rest) < len(parsed_rest):
+            gold_rest.append(NO_ENTITY)
+        while len(parsed_rest) < len(gold_rest):
+            parsed_rest.append(NO_ENTITY)
+
+        # Add to the total lists of NEs
+        self.all_gold_entities.extend(matched.elements())
+        self.all_parsed_entities.extend(matched.elements())
+        self.all_gold_entities.extend(gold_rest)
+        self.all_parsed_entities.extend(parsed_rest)
+
+    def update(self, other):
+        """Add the counts of another NamedEntityScores (e.g. from a shard
+        of sentences that comes after the ones already counted)"""
+        for ne, count in other.gold_entity_counts.items():
+            self.gold_entity_counts[ne] = \
+                self.gold_entity_counts.get(ne, 0) + count
+        for ne, count in other.parsed_entity_counts.items():
+            self.parsed_entity_counts[ne] = \
+                self.parsed_entity_counts.get(ne, 0) + count
+        self.extra_ne_count += other.extra_ne_count
+        self.missing_ne_count += other.missing_ne_count
+        self.ne_mismatch_count += other.ne_mismatch_count
+        self.perfect_match_count += other.perfect_match_count
+        self.perfect_match_nonempty_count += \
+            other.perfect_match_nonempty_count
+        self.all_gold_entities.extend(other.all_gold_entities)
+        self.all_parsed_entities.extend(other.all_parsed_entities)
+        self.sentence_counts.extend(other.sentence_counts)
+        self.span_scores.update(other.span_scores)
+        self.unmatched_gold_count += other.unmatched_gold_count
+        self.unmatched_parsed_count += other.unmatched_parsed_count
+
+    def report(self):
+        """Print the error counts"""
+        print("Extra NEs: {}".format(self.extra_ne_count))
+        print("Missing NEs: {}".format(self.missing_ne_count))
+        print("Mismatch NEs: {}".format(self.ne_mismatch_count))
+        print("Perfect (nonempty) match: {}".format(
+            self.perfect_match_nonempty_count))
+        self.span_scores.report()
+        print("Unmatched gold ids: {}".format(self.unmatched_gold_count))
+        print("Unmatched parsed ids: {}".format(self.unmatched_parsed_count))
+        print()
+
+class EntityConfusion(object):
+    """Gold x parsed confusion matrix of the NE tags of one system, and the
+    per-tag precision, recall and F-score that follow from it
+
+    Members:
+        alphabet: util.Alphabet of the tags; index 0 is NO_ENTITY
+        matrix: matrix[i, j] is the number of gold tags i paired with parsed
+            tags j (see NamedEntityScores.add), so the diagonal holds the
+            correct tags, row NO_ENTITY the extra ones and column NO_ENTITY
+            the missing ones
+    """
+
+    def __init__(self, scores):
+        """
+        Inputs:
+            scores: NamedEntityScores
+        """
+        self.alphabet = Alphabet()
+        self.alphabet.add(NO_ENTITY)
+        index = self.alphabet.get_default_index
+        gold = np.fromiter((index(ne) for ne in scores.all_gold_entities),
+                           dtype=np.int64, count=len(scores.all_gold_entities))
+        parsed = np.fromiter(
+            (index(ne) for ne in scores.all_parsed_entities),
+            dtype=np.int64, count=len(scores.all_parsed_entities))
+        size = self.alphabet.size()
+        self.matrix = np.bincount(
+            gold * size + parsed, minlength=size * size).reshape(size, size)
+
+    def type_scores(self):
+        """Get the scores of each tag
+        Returns:
+            list of (tag, gold count, parsed count, correct count, precision,
+            recall, F-score), most frequent gold tags first
+        """
+        correct = self.matrix.diagonal()
+        gold = self.matrix.sum(axis=1)
+        parsed = self.matrix.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(parsed > 0, correct / parsed, 0.0)
+            recall = np.where(gold > 0, correct / gold, 0.0)
+        f = f_score(np.stack([correct, parsed, gold], axis=1))
+        rows = [(self.alphabet.get_label(i), int(gold[i]), int(parsed[i]),
+                 int(correct[i]), float(precision[i]), float(recall[i]),
+                 float(f[i]))
+                for i in range(1, self.alphabet.size())]
+        rows.sort(key=lambda row: (-row[1], -row[2], row[0]))
+        return rows
+
+    def report(self, rows=None):
+        """Print the scores of the most frequent gold tags
+        Inputs:
+            rows: number of tags to print (None = TYPE_REPORT_ROWS)
+        """
+        if rows is None:
+            rows = TYPE_REPORT_ROWS
+        line = "{:<24} {:>6} {:>6} {:>7} {:>6} {:>6} {:>6}"
+        print(line.format("NE", "Gold", "Parsed", "Correct", "P", "R", "F1"))
+        for tag, gold, parsed, correct, p, r, f in self.type_scores()[:rows]:
+            print(line.format(tag, gold, parsed, correct, "{:.3f}".format(p),
+                              "{:.3f}".format(r), "{:.3f}".format(f)))
+        print()
+
+    def save_csv(self, types_fname, confusion_fname):
+        """Save the per-tag scores and the confusion matrix as CSV
+        Inputs:
+            types_fname: file for one row of scores per tag
+            confusion_fname: file for the matrix, gold tags down the first
+                column and parsed tags along the first row
+        """
+        with open(types_fname, 'w') as dest:
+            writer = csv.writer(dest)
+            writer.writerow(["NE", "Gold", "Parsed", "Correct", "Precision",
+                             "Recall", "F1"])
+            writer.writerows(self.type_scores())
+        labels = [self.alphabet.get_label(i)
+                  for i in range(self.alphabet.size())]
+        with open(confusion_fname, 'w') as dest:
+            writer = csv.writer(dest)
+            writer.writerow(["gold/parsed"] + labels)
+            for label, row in zip(labels, self.matrix.tolist()):
+                writer.writerow([label] + row)
+
+    def save_json(self, fname):
+        """Save the per-tag scores and the confusion matrix as JSON"""
+        fields = ["gold", "parsed", "correct", "precision", "recall", "f1"]
+        with open(fname, 'w') as dest:
+            json.dump({
+                "labels": [self.alphabet.get_label(i)
+                           for i in range(self.alphabet.size())],
+                "confusion": self.matrix.tolist(),
+                "types": {row[0]: dict(zip(fields, row[1:]))
+                          for row in self.type_scores()},
+            }, dest, ensure_ascii=False, indent=1)
+
+def _shards(items, size=None):
+    """Split a stream into lists of at most size items (None = SHARD_SIZE)"""
+    if size is None:
+        size = SHARD_SIZE
+    items = iter(items)
+    while True:
+        shard = list(islice(items, size))
+        if not shard:
+            return
+        yield shard
+
+def _map_shards(pool, func, shards):
+    """Apply func to each shard, in order, with pool (or serially if pool
+    is None). At most MAX_PENDING_SHARDS shards are in flight at a time,
+    so the input is streamed rather than read all at once."""
+    if pool is None:
+        for shard in shards:
+            yield func(shard)
+        return
+    pending = deque()
+    for shard in shards:
+        pending.append(pool.apply_async(func, (shard,)))
+        if len(pending) >= MAX_PENDING_SHARDS:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def _gold_shard(records):
+    """Get the (id, named entities) of a shard of gold (comment, amr)
+    records"""
+    return [(comment['id'], extract_name_edges(amr))
+            for comment, amr in records]
+
+def _score_shard(shard):
+    """Score a shard of (gold named entities, parsed amr or None,
+    postprocessing)"""
+    scores = NamedEntityScores()
+    for gold_entities, parsed_amr, postprocessing in shard:
+        # Normalize the NE tags if we're doing postprocessing
+        gold_spans = entity_spans(gold_entities, postprocessing)
+        if parsed_amr is None:
+            scores.add([span[0] for span in gold_spans], None)
+            scores.span_scores.add(gold_spans, [])
+            continue
+        parsed_spans = entity_spans(
+            extract_name_edges(parsed_amr), postprocessing)
+        scores.add([span[0] for span in gold_spans],
+                   [span[0] for span in parsed_spans])
+        scores.span_scores.add(gold_spans, parsed_spans)
+    return scores
+
+def read_gold_named_entities(gold_amr_file, pool=None, use_cache=None):
+    """Parse the gold AMRs and get their named entities, once
+    Inputs:
+        gold_amr_file: file with the gold (human-annotated) AMRs
+        pool: optional multiprocessing.Pool to parse with
+        use_cache: whether to load the parsed AMRs from the on-disk cache
+            (None = USE_AMR_CACHE)
+    Returns:
+        list of (id, named entities as from extract_name_edges), one per
+        gold AMR
+    """
+    if use_cache is None:
+        use_cache = USE_AMR_CACHE
+    if use_cache is True:
+        return [(comment['id'], graph_name_edges(amr_graph))
+                for comment, amr_graph in load_parsed_amrs(gold_amr_file)]
+
+    gold_named_entities = list()
+    shards = _shards(iter_amrz_mapped(gold_amr_file))
+    for result in _map_shards(pool, _gold_shard, shards):
+        gold_named_entities.extend(result)
+    return gold_named_entities
+
+class OutOfOrderError(Exception):
+    """A parsed AMR came after its gold sentence was given up on"""
+
+def align_by_id(gold_named_entities, parsed_records, unmatched,
+                window=None, hashed=False):
+    """Pair gold sentences with parsed AMRs by ::id, in gold order
+    When the parsed AMRs come in the gold order this is a streaming
+    merge-join: a parsed AMR that arrives early (because the ones before
+    it are out of order or missing) waits until its gold sentence comes
+    up, and once more than window of them are waiting, the gold sentence
+    that holds them up is taken to have no parse. Memory thus depends on
+    the window, not on the size of the parsed file.
+    Inputs:
+        gold_named_entities: list of (id, named entities) from
+            read_gold_named_entities
+        parsed_records: stream of parsed (comment, amr) records
+        unmatched: dict; unmatched['parsed'] is set to the number of parsed
+            AMRs whose id is not in gold or was already seen
+        window: number of parsed AMRs that may wait for their gold sentence
+            (None = ALIGN_WINDOW)
+        hashed: read all parsed AMRs into a dict by id first (for files that
+            are not in the gold order)
+    Returns:
+        generator of (gold named entities, parsed amr or None), one per gold
+        sentence
+    Raises:
+        OutOfOrderError if a parsed AMR is more than window places late
+    """
+    if window is None:
+        window = ALIGN_WINDOW
+    position = dict()
+    for i, (amr_id, _) in enumerate(gold_named_entities):
+        key = record_id({'id': amr_id})
+        if key is not None:
+            position.setdefault(key, i)
+    unmatched['parsed'] = 0
+    if hashed is True:
+        parsed = dict()
+        for comment, amr in parsed_records:
+            i = position.get(record_id(comment))
+            if i is None or i in parsed:
+                unmatched['parsed'] += 1
+            else:
+                parsed[i] = amr
+        for i, (_, gold_entities) in enumerate(gold_named_entities):
+            yield gold_entities, parsed.get(i)
+        return
+
+    next_index = 0
+    pending = dict()
+    skipped = set()
+    for comment, amr in parsed_records:
+        i = position.get(record_id(comment))
+        if i is None or i in pending:
+            unmatched['parsed'] += 1
+            continue
+        if i < next_index:
+            if i in skipped:
+                raise OutOfOrderError(record_id(comment))
+            # the gold sentence already has its parse
+            unmatched['parsed'] += 1
+            continue
+        pending[i] = amr
+        # with too many waiting, the sentence holding them up has no parse
+        while next_index in pending or len(pending) > window:
+            parsed_amr = pending.pop(next_index, None)
+            if parsed_amr is None:
+                skipped.add(next_index)
+            yield gold_named_entities[next_index][1], parsed_amr
+            next_index += 1
+    for i in range(next_index, len(gold_named_entities)):
+        yield gold_named_entities[i][1], pending.pop(i, None)
+
+def score_named_entities(gold_named_entities, parsed_amr_file,
+                         postprocessing=False, pool=None, hashed=False):
+    """Stream parsed AMRs against named entities already read from the gold
+    file, pairing them by ::id (see align_by_id)
+    Inputs:
+        gold_named_entities: list of (id, named entities) from
+            read_gold_named_entities
+        parsed_amr_file: file with the parsed (machine-annotated) AMRs
+        postprocessing: whether to normalize NE tags
+        pool: optional multiprocessing.Pool to score shards of sentences with
+        hashed: pair by a dict of all parsed AMRs instead of a merge-join;
+            used again automatically if the parsed file is out of order
+    Returns:
+        NamedEntityScores
+    """
+    # Each record is (comment, amr) with comment {'snt':snt,'id':id}
+    parsed_records = iter_amrz_mapped(parsed_amr_file)
+    unmatched = dict()
+
+    def sentences():
+        for gold_entities, parsed_amr in align_by_id(
+                gold_named_entities, parsed_records, unmatched, hashed=hashed):
+            yield gold_entities, parsed_amr, postprocessing
+
+    # Shards are merged in order, so the result doesn't depend on pool
+    scores = NamedEntityScores()
+    try:
+        for shard_scores in _map_shards(
+                pool, _score_shard, _shards(sentences())):
+            scores.update(shard_scores)
+    except OutOfOrderError:
+        return score_named_entities(gold_named_entities, parsed_amr_file,
+                                    postprocessing, pool, hashed=True)
+    scores.unmatched_parsed_count = unmatched['parsed']
+    return scores
+
+def evaluate_named_entities(gold_amr_file, parsed_amr_file, postprocessing=False,
+                            workers=None):
     """Compare NE tagging for gold and parsed AMRs
     Inputs:
         gold_amr_file: file with the gold (human-annotated) AMRs
         parsed_amr_file: file with the parsed (machine-annotated) AMRs
         postprocessing: whether to normalize NE tags
+        workers: number of worker processes (1 = evaluate serially;
+            None = WORKERS)
     Returns:
-        None (prints result)
+        NamedEntityScores (and prints result)
     """
-    print("Comparing named entities in gold {} vs parsed {}".format(
-        gold_amr_file, parsed_amr_file
-    ))
-    if postprocessing is True:
-        print("Performing postprocessing")
-    else:
-        print("Not performing postprocessing")
-
-    gold_entity_counts = dict()
-    parsed_entity_counts = dict()
-
-    # Types of NE errors
-    extra_ne_count = 0  # Parser has NE where gold has none
-    missing_ne_count = 0  # Parser lacks NE where gold has one
-    ne_mismatch_count = 0  # NE count matches but tags don't match
-    perfect_match_count = 0  # NE count matches (could be zero)
-    perfect_match_nonempty_count = 0  # NE count matches (nonzero) and tags too
-
-    # Get gold amrs
-    gold_comments_and_amrs = read_amrz(gold_amr_file)  # (comments, amrs)
-    gold_comments = gold_comments_and_amrs[0]  # {'snt':snt,'id':id}
-    gold_amrs = gold_comments_and_amrs[1]
-
-    # Get parsed amrs
-    parsed_comments_and_amrs = read_amrz(parsed_amr_file)  # (comments, amrs)
-    parsed_comments = parsed_comments_and_amrs[0]  # {'snt':snt,'id':id}
-    parsed_amrs = parsed_comments_and_amrs[1]
-
-    # Keep track of all the entities
-    all_gold_entities = list()
-    all_parsed_entities = list()
-    for i in range(len(gold_amrs)):
-        gold_id = gold_comments[i]['id']
-        gold_amr_graph = AMR.parse_AMR_line(gold_amrs[i])
-        # variable to concept graph (from Damonte & Cohen)
-        gold_v2c = {}
-        for n, v in zip(gold_amr_graph.nodes, gold_amr_graph.node_values):
-            gold_v2c[n] = v
-
-        # relation, arg1, arg2 triples (from Damonte & Cohen)
-        # e.g. (name, v1, v2) means "v1 is name of v2"
-        # The indices are because triples() returns a list of lists
-        gold_triples = [t for t in gold_amr_graph.get_triples()[1]]
-        gold_triples.extend([t for t in gold_amr_graph.get_triples()[2]])
-        gold_named_entities = [
-            str(gold_v2c[v1]) for (l,v1,v2) in gold_triples if l == "name"
-        ]
+    return evaluate_systems(
+        gold_amr_file, [(parsed_amr_file, postprocessing)], workers)[0]
 
-        # Normalize the NE tags if we're doing postprocessing
-        if postprocessing is True:
-            gold_named_entities = [
-                normalize_entity(e) for e in gold_named_entities
-            ]
+def save_entity_confusion(confusion, dest_dir, parsed_amr_file,
+                          postprocessing):
+    """Save the EntityConfusion of a system as CSV and JSON files named
+    after the parsed file, e.g. <parsed file>.post.types.csv
+    Inputs:
+        confusion: EntityConfusion
+        dest_dir: folder to save to
+        parsed_amr_file: file with the parsed AMRs of the system
+        postprocessing: whether the NE tags were normalized
+    """
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+    prefix = os.path.join(dest_dir, os.path.basename(parsed_amr_file) +
+                          (".post" if postprocessing is True else ""))
+    confusion.save_csv(prefix + ".types.csv", prefix + ".confusion.csv")
+    confusion.save_json(prefix + ".ne.json")
 
-        for ne in gold_named_entities:
-            gold_entity_counts[ne] = gold_entity_counts.get(ne, 0) + 1
-
-        # We're assuming the length of gold and parsed AMRs is the same
-        # TODO: this is brittle and should be made more robust
-        if len(parsed_amrs) >= i:
-            # Get the parsed AMR corresponding to the gold AMR
-            parsed_amr = parsed_amrs[i]
-            parsed_amr_graph = AMR.parse_AMR_line(parsed_amr)
-            # variable to concept graph (from Damonte & Cohen)
-            parsed_v2c = {}
-            for n, v in zip(
-                        parsed_amr_graph.nodes, parsed_amr_graph.node_values):
-                parsed_v2c[n] = v
-            # relation, arg1, arg2 triples (from Damonte & Cohen)
-            # e.g. (name, v1, v2) means "v1 is name of v2"
-            # The indices are because triples() returns a list of lists
-            parsed_triples = [t for t in parsed_amr_graph.get_triples()[1]]
-            parsed_triples.extend(
-                            [t for t in parsed_amr_graph.get_triples()[2]])
-            parsed_named_entities = [
-                        str(parsed_v2c[v1]) for (l,v1,v2) in parsed_triples
-                        if l == "name"
-            ]
-
-            # Normalize the NE tags if we're doing postprocessing
+def evaluate_systems(gold_amr_file, systems, workers=None,
+                     bootstrap_samples=None, type_report_rows=None,
+                     type_scores_dir=None):
+    """Compare NE tagging of several parsed files against one gold file.
+    The gold AMRs are only read and parsed once.
+    Inputs:
+        gold_amr_file: file with the gold (human-annotated) AMRs
+        systems: list of (parsed_amr_file, postprocessing) pairs
+        workers: number of worker processes (1 = evaluate serially)
+        bootstrap_samples: number of paired bootstrap samples for the
+            significance of the differences between systems (0 = none)
+        type_report_rows: number of NE tags in the per-type P/R/F1 table
+            printed for each system (0 = no table)
+        type_scores_dir: folder to save the per-type scores and confusion
+            matrix of each system to
+        Each of these is read from the module setting of the same name in
+        capitals (e.g. WORKERS) when it is None; TYPE_SCORES_DIR = None
+        means the scores are not saved.
+    Returns:
+        list of NamedEntityScores, one per system (and prints result)
+    """
+    if workers is None:
+        workers = WORKERS
+    if bootstrap_samples is None:
+        bootstrap_samples = BOOTSTRAP_SAMPLES
+    if type_report_rows is None:
+        type_report_rows = TYPE_REPORT_ROWS
+    if type_scores_dir is None:
+        type_scores_dir = TYPE_SCORES_DIR
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        gold_named_entities = read_gold_named_entities(gold_amr_file, pool)
+
+        results = list()
+        for parsed_amr_file, postprocessing in systems:
+            print("Comparing named entities in gold {} vs parsed {}".format(
+                gold_amr_file, parsed_amr_file
+            ))
             if postprocessing is True:
-                parsed_named_entities = [
-                    normalize_entity(e) for e in parsed_named_entities
-            ]
-
-            for ne in parsed_named_entities:
-                parsed_entity_counts[ne] = parsed_entity_counts.get(ne, 0) + 1
-
-            # Get the various error counts
-            if len(gold_named_entities) < len(parsed_named_entities):
-                extra_ne_count += 1
-            elif len(gold_named_entities) > len(parsed_named_entities):
-                missing_ne_count += 1
-            elif gold_named_entities == parsed_named_entities and \
-                    len(gold_named_entities) > 0:
-                perfect_match_nonempty_count += 1
-            elif gold_named_entities == parsed_named_entities:
-                perfect_match_count += 1
+                print("Performing postprocessing")
             else:
-                ne_mismatch_count += 1
-
-            # If the lists of entities are different, add "None"
-            while len(gold_named_entities) < len(parsed_named_entities):
-                gold_named_entities.append("None")
-            while len(parsed_named_entities) < len(gold_named_entities):
-                parsed_named_entities.append("None")
-
-            # Add to the total lists of NEs
-            all_gold_entities.extend(gold_named_entities)
-            all_parsed_entities.extend(parsed_named_entities)
-
-    print("Extra NEs: {}".format(extra_ne_count))
-    print("Missing NEs: {}".format(missing_ne_count))
-    print("Mismatch NEs: {}".format(ne_mismatch_count))
-    print("Perfect (nonempty) match: {}".format(perfect_match_nonempty_count))
+                print("Not performing postprocessing")
+            scores = score_named_entities(
+                gold_named_entities, parsed_amr_file, postprocessing, pool)
+            scores.report()
+            if type_report_rows > 0 or type_scores_dir is not None:
+                confusion = EntityConfusion(scores)
+                if type_report_rows > 0:
+                    confusion.report(type_report_rows)
+                if type_scores_dir is not None:
+                    save_entity_confusion(
+                        confusion, type_scores_dir, parsed_amr_file,
+                        postprocessing)
+            results.append(scores)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if len(systems) > 1:
+        print_summary(gold_amr_file, systems, results)
+        if bootstrap_samples > 0:
+            print_significance(systems, results, bootstrap_samples)
+    return results
+
+def print_summary(gold_amr_file, systems, results):
+    """Print one line of error counts per system
+    Inputs:
+        gold_amr_file: file with the gold (human-annotated) AMRs
+        systems: list of (parsed_amr_file, postprocessing) pairs
+        results: list of NamedEntityScores, one per system
+    """
+    print("Summary against gold {}".format(gold_amr_file))
+    row = "{:<55} {:>5} {:>6} {:>8} {:>9} {:>8}"
+    print(row.format(
+        "Parsed", "Post", "Extra", "Missing", "Mismatch", "Perfect"))
+    for (parsed_amr_file, postprocessing), scores in zip(systems, results):
+        print(row.format(
+            os.path.basename(parsed_amr_file),
+            "yes" if postprocessing is True else "no",
+            scores.extra_ne_count,
+            scores.missing_ne_count,
+            scores.ne_mismatch_count,
+            scores.perfect_match_nonempty_count,
+        ))
+    print()
+
+def print_significance(systems, results, samples, seed=None):
+    """Print the paired bootstrap confidence intervals and p-values of the
+    NE F-score and error counts, for each pair of systems. The counts of
+    each sentence are taken from the scores; only they are resampled.
+    Inputs:
+        systems: list of (parsed_amr_file, postprocessing) pairs
+        results: list of NamedEntityScores, one per system
+        samples: number of bootstrap samples
+        seed: seed of the bootstrap samples (None = BOOTSTRAP_SEED)
+    """
+    if seed is None:
+        seed = BOOTSTRAP_SEED
+    names = ["{}{}".format(os.path.basename(parsed_amr_file),
+                           " (post)" if postprocessing is True else "")
+             for parsed_amr_file, postprocessing in systems]
+    counts = [scores.sentence_counts for scores in results]
+    print("Paired bootstrap with {} samples".format(samples))
+    statistics = [("NE F-score", f_score, 4)]
+    for name, column in [("Extra NEs", "extra"), ("Missing NEs", "missing"),
+                         ("Mismatch NEs", "mismatch"),
+                         ("Perfect (nonempty) match", "perfect_nonempty")]:
+        statistics.append(
+            (name, column_total(SENTENCE_COUNT_COLUMNS.index(column)), 0))
+    for name, statistic, precision in statistics:
+        print("{}:".format(name))
+        for line in compare_all(names, counts, statistic, samples, seed,
+                                precision=precision):
+            print(line)
     print()
 
 if __name__ == "__main__":
-    evaluate_named_entities(GOLD_TEST, BASIC_TEST)
-    evaluate_named_entities(GOLD_TEST, BASIC_TEST, postprocessing=True)
+    evaluate_systems(GOLD_TEST, [
+        (BASIC_TEST, False),
+        (BASIC_TEST, True),
 
-    evaluate_named_entities(GOLD_TEST, SIBLING_TEST)
-    evaluate_named_entities(GOLD_TEST, SIBLING_TEST, postprocessing=True)
+        (SIBLING_TEST, False),
+        (SIBLING_TEST, True),
 
-    evaluate_named_entities(GOLD_TEST, SIBLING_BIGRAM_TEST)
-    evaluate_named_entities(GOLD_TEST, SIBLING_BIGRAM_TEST, postprocessing=True)
+        (SIBLING_BIGRAM_TEST, False),
+        (SIBLING_BIGRAM_TEST, True),
+    ])
 
     evaluate_named_entities(NORMALIZED_NE_GOLD, NORMALIZED_NE_PARSED)
@@ -7,7 +7,9 @@ For detailed description of AMR, see http://www.isi.edu/natural-language/amr/a.p
 
 """
 
+from __future__ import print_function
 from collections import defaultdict
+import re
 import sys
 
 # change this if needed
@@ -16,6 +18,9 @@ ERROR_LOG = sys.stderr
 # change this if needed
 DEBUG_LOG = sys.stderr
 
+# significant symbols of an AMR line, for splitting in AMR.parse_AMR_line_fast
+AMR_SPLIT_RE = re.compile(r'(["():/])')
+
 
 class AMR(object):
     """
@@ -161,7 +166,7 @@ class AMR(object):
         Output AMR string
 
         """
-        print >> DEBUG_LOG, self.__str__()
+        print(self.__str__(), file=DEBUG_LOG)
 
 
     @staticmethod
@@ -218,7 +223,7 @@ class AMR(object):
                 if state == 2:
                     # in this state, current relation name should be empty
                     if cur_relation_name != "":
-                        print >> ERROR_LOG, "Format error when processing ", line[0:i+1]
+                        print("Format error when processing ", line[0:i+1], file=ERROR_LOG)
                         return None
                     # update current relation name for future use
                     cur_relation_name = "".join(cur_charseq).strip()
@@ -251,9 +256,10 @@ class AMR(object):
                 elif state == 2:
                     temp_attr_value = "".join(cur_charseq)
                     cur_charseq[:] = []
-                    parts = temp_attr_value.split()
+                    # the value is the rest: a quoted string may contain spaces
+                    parts = temp_attr_value.split(None, 1)
                     if len(parts) < 2:
-                        print >> ERROR_LOG, "Error in processing; part len < 2", line[0:i+1]
+                        print("Error in processing; part len < 2", line[0:i+1], file=ERROR_LOG)
                         return None
                     # For the above example, node name is "op1", and node value is "w"
                     # Note that this node name might not be encountered before
@@ -262,7 +268,7 @@ class AMR(object):
                     # We need to link upper level node to the current
                     # top of stack is upper level node
                     if len(stack) == 0:
-                        print >> ERROR_LOG, "Error in processing", line[:i], relation_name, relation_value
+                        print("Error in processing", line[:i], relation_name, relation_value, file=ERROR_LOG)
                         return None
                     # if we have not seen this node name before
                     if relation_value not in node_dict:
@@ -283,7 +289,7 @@ class AMR(object):
                     cur_charseq[:] = []
                     # if this node name is already in node_dict, it is duplicate
                     if node_name in node_dict:
-                        print >> ERROR_LOG, "Duplicate node name ", node_name, " in parsing AMR"
+                        print("Duplicate node name ", node_name, " in parsing AMR", file=ERROR_LOG)
                         return None
                     # push the node name to stack
                     stack.append(node_name)
@@ -310,7 +316,7 @@ class AMR(object):
                         cur_relation_name = ""
                 else:
                     # error if in other state
-                    print >> ERROR_LOG, "Error in parsing AMR", line[0:i+1]
+                    print("Error in parsing AMR", line[0:i+1], file=ERROR_LOG)
                     return None
                 state = 3
             elif c == ")":
@@ -319,7 +325,7 @@ class AMR(object):
                     continue
                 # stack should be non-empty to find upper level node
                 if len(stack) == 0:
-                    print >> ERROR_LOG, "Unmatched parenthesis at position", i, "in processing", line[0:i+1]
+                    print("Unmatched parenthesis at position", i, "in processing", line[0:i+1], file=ERROR_LOG)
                     return None
                 # Last significant symbol is ":". Now we encounter ")"
                 # Example:
@@ -328,9 +334,10 @@ class AMR(object):
                 if state == 2:
                     temp_attr_value = "".join(cur_charseq)
                     cur_charseq[:] = []
-                    parts = temp_attr_value.split()
+                    # the value is the rest: a quoted string may contain spaces
+                    parts = temp_attr_value.split(None, 1)
                     if len(parts) < 2:
-                        print >> ERROR_LOG, "Error processing", line[:i+1], temp_attr_value
+                        print("Error processing", line[:i+1], temp_attr_value, file=ERROR_LOG)
                         return None
                     relation_name = parts[0].strip()
                     relation_value = parts[1].strip()
@@ -368,7 +375,7 @@ class AMR(object):
         attribute_list = []
         for v in node_name_list:
             if v not in node_dict:
-                print >> ERROR_LOG, "Error: Node name not found", v
+                print("Error: Node name not found", v, file=ERROR_LOG)
                 return None
             else:
                 node_value_list.append(node_dict[v])
@@ -397,18 +404,142 @@ class AMR(object):
         result_amr = AMR(node_name_list, node_value_list, relation_list, attribute_list)
         return result_amr
 
+    @staticmethod
+    def parse_AMR_line_fast(line):
+        """
+        Same result as parse_AMR_line, but instead of visiting every character, the line is
+        split at the significant symbols with AMR_SPLIT_RE and each symbol is handled together
+        with the text that follows it. Lines with format errors are handed to parse_AMR_line,
+        so the error messages are the same.
+
+        """
+        # see parse_AMR_line for the meaning of the states and data structures
+        state = 0
+        stack = []
+        # current not-yet-reduced text (spaces are only kept in state 2)
+        cur_charseq = ""
+        node_dict = {}
+        node_name_list = []
+        node_relation_dict1 = defaultdict(list)
+        node_relation_dict2 = defaultdict(list)
+        cur_relation_name = ""
+        in_quote = False
+        # [text, symbol, text, symbol, text, ...]
+        pieces = AMR_SPLIT_RE.split(line.strip())
+        cur_charseq = pieces[0].replace(" ", "")
+        for c, text in zip(pieces[1::2], pieces[2::2]):
+            if c == "\"":
+                if in_quote:
+                    cur_charseq += "_"
+                in_quote = not in_quote
+            elif in_quote:
+                cur_charseq += c
+            elif c == ":":
+                if state == 3:
+                    node_dict[stack[-1]] = cur_charseq
+                    cur_charseq = ""
+                elif state == 2:
+                    parts = cur_charseq.split(None, 1)
+                    cur_charseq = ""
+                    if len(parts) < 2 or len(stack) == 0:
+                        return AMR.parse_AMR_line(line)
+                    relation_value = parts[1].strip()
+                    if relation_value not in node_dict:
+                        node_relation_dict2[stack[-1]].append((parts[0], relation_value))
+                    else:
+                        node_relation_dict1[stack[-1]].append((parts[0], relation_value))
+                state = 2
+            elif c == "(":
+                if state == 2:
+                    if cur_relation_name != "":
+                        return AMR.parse_AMR_line(line)
+                    cur_relation_name = cur_charseq.strip()
+                    cur_charseq = ""
+                state = 1
+            elif c == "/":
+                if state != 1:
+                    return AMR.parse_AMR_line(line)
+                node_name = cur_charseq
+                cur_charseq = ""
+                if node_name in node_dict:
+                    return AMR.parse_AMR_line(line)
+                stack.append(node_name)
+                node_name_list.append(node_name)
+                if cur_relation_name != "":
+                    if not cur_relation_name.endswith("-of"):
+                        node_relation_dict1[stack[-2]].append((cur_relation_name, node_name))
+                    else:
+                        node_relation_dict1[node_name].append((cur_relation_name[:-3], stack[-2]))
+                    cur_relation_name = ""
+                state = 3
+            else:  # ")"
+                if len(stack) == 0:
+                    return AMR.parse_AMR_line(line)
+                if state == 2:
+                    parts = cur_charseq.split(None, 1)
+                    cur_charseq = ""
+                    if len(parts) < 2:
+                        return AMR.parse_AMR_line(line)
+                    relation_name = parts[0]
+                    relation_value = parts[1].strip()
+                    if relation_name.endswith("-of"):
+                        node_relation_dict1[relation_value].append((relation_name[:-3], stack[-1]))
+                    elif relation_value not in node_dict:
+                        node_relation_dict2[stack[-1]].append((relation_name, relation_value))
+                    else:
+                        node_relation_dict1[stack[-1]].append((relation_name, relation_value))
+                elif state == 3:
+                    node_dict[stack[-1]] = cur_charseq
+                    cur_charseq = ""
+                stack.pop()
+                cur_relation_name = ""
+                state = 0
+            if text:
+                cur_charseq += text if state == 2 else text.replace(" ", "")
+        node_value_list = []
+        relation_list = []
+        attribute_list = []
+        for v in node_name_list:
+            if v not in node_dict:
+                return AMR.parse_AMR_line(line)
+            node_value_list.append(node_dict[v])
+            relation_dict = {}
+            attribute_dict = {}
+            if v in node_relation_dict1:
+                for v1 in node_relation_dict1[v]:
+                    relation_dict[v1[1]] = v1[0]
+            if v in node_relation_dict2:
+                for v2 in node_relation_dict2[v]:
+                    if v2[1][0] == "\"" and v2[1][-1] == "\"":
+                        attribute_dict[v2[0]] = v2[1][1:-1]
+                    elif v2[1] in node_dict:
+                        relation_dict[v2[1]] = v2[0]
+                    else:
+                        attribute_dict[v2[0]] = v2[1]
+            relation_list.append(relation_dict)
+            attribute_list.append(attribute_dict)
+        if not node_name_list:
+            return AMR.parse_AMR_line(line)
+        attribute_list[0]["TOP"] = node_value_list[0]
+        return AMR(node_name_list, node_value_list, relation_list, attribute_list)
+
 # test AMR parsing
 # a unittest can also be used.
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print >> ERROR_LOG, "No file given"
+        print("No file given", file=ERROR_LOG)
         exit(1)
     amr_count = 1
     for line in open(sys.argv[1]):
         cur_line = line.strip()
         if cur_line == "" or cur_line.startswith("#"):
             continue
-        print >> DEBUG_LOG, "AMR", amr_count
+        print("AMR", amr_count, file=DEBUG_LOG)
         current = AMR.parse_AMR_line(cur_line)
         current.output_amr()
+        # the fast parser must build the same AMR
+        fast = AMR.parse_AMR_line_fast(cur_line)
+        if (fast.nodes, fast.node_values, fast.relations, fast.attributes) != \
+                (current.nodes, current.node_values, current.relations, current.attributes):
+            print("parse_AMR_line_fast differs on AMR", amr_count, file=ERROR_LOG)
         amr_count += 1
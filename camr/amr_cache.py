@@ -0,0 +1,191 @@
+# -*- coding:utf-8 -*-
+
+'''
+on-disk cache of parsed AMR graphs
+
+Every evaluation run parses the same gold file again, with
+AMR.parse_AMR_line for NE checking and with AMRZ.parse_string for
+preprocessing. This cache saves the parsed graphs of a whole file in a
+compact marshal format, keyed by the SHA-1 of the file content and by the
+parser name and version, so later runs on the same file only load them.
+
+The cache directory is kept under MAX_CACHE_BYTES by deleting the least
+recently used entries. Run this module with --clear to invalidate it.
+'''
+
+from __future__ import print_function
+import argparse
+import gc
+import hashlib
+import marshal
+import os
+import sys
+from collections import OrderedDict
+from amr import AMR
+from amr_graph import AMRZ
+from amr_corpus import iter_amrz_mapped
+
+# where cached graphs are kept; override with the AMR_CACHE_DIR variable
+CACHE_DIR = os.environ.get(
+    'AMR_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'camr_ne'))
+
+# total size of the cache before least recently used entries are deleted
+MAX_CACHE_BYTES = 1 << 30
+
+# suffix of the cache entry files
+CACHE_SUFFIX = '.amrcache'
+
+
+def _pack_amr(amr):
+    if amr is None:
+        return None
+    return (amr.nodes, amr.node_values, amr.relations, amr.attributes)
+
+
+def _unpack_amr(t):
+    if t is None:
+        return None
+    return AMR(*t)
+
+
+# parser name -> (version, parse, pack, unpack)
+# bump the version whenever the parser's output changes
+PARSERS = {
+    'amr': (2, AMR.parse_AMR_line_fast, _pack_amr, _unpack_amr),
+    'amrz': (1, AMRZ.parse_string, AMRZ.to_tuple, AMRZ.from_tuple),
+}
+
+
+def content_hash(amr_filepath):
+    '''SHA-1 hex digest of a file's content'''
+    digest = hashlib.sha1()
+    with open(amr_filepath, 'rb') as amrfile:
+        for block in iter(lambda: amrfile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(digest, parser, cache_dir=None):
+    version = PARSERS[parser][0]
+    return os.path.join(cache_dir or CACHE_DIR,
+                        '%s.%s-v%d%s' % (digest, parser, version, CACHE_SUFFIX))
+
+
+def _entries(cache_dir):
+    '''(path, size, mtime) of every cache entry'''
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for fname in os.listdir(cache_dir):
+        if fname.endswith(CACHE_SUFFIX):
+            path = os.path.join(cache_dir, fname)
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime))
+    return entries
+
+
+def evict(cache_dir=None, max_bytes=None):
+    '''delete least recently used entries until the cache fits in max_bytes'''
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    entries = sorted(_entries(cache_dir), key=lambda e: e[2])
+    total = sum(size for path, size, mtime in entries)
+    for path, size, mtime in entries:
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def clear_cache(amr_filepath=None, cache_dir=None):
+    '''
+    delete the cached graphs of one file (all parsers and versions),
+    or the whole cache; returns the number of entries deleted
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    prefix = content_hash(amr_filepath) + '.' if amr_filepath else ''
+    removed = 0
+    for path, size, mtime in _entries(cache_dir):
+        if os.path.basename(path).startswith(prefix):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def load_parsed_amrs(amr_filepath, parser='amr', cache_dir=None):
+    '''
+    parse every record of an AMR file, or load the graphs from the cache
+    if this file content has been parsed with this parser version before
+
+    returns a list of (comment, graph) pairs, where graph is an AMR
+    ('amr' parser) or AMRZ ('amrz' parser) and None for AMRs that
+    AMR.parse_AMR_line rejects
+    '''
+    version, parse, pack, unpack = PARSERS[parser]
+    cache_dir = cache_dir or CACHE_DIR
+    path = cache_path(content_hash(amr_filepath), parser, cache_dir)
+
+    # loading allocates many small containers; the cyclic collector would
+    # otherwise keep rescanning everything already in memory
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, 'rb') as cachefile:
+            comments, graphs = marshal.load(cachefile)
+        # mark as recently used
+        os.utime(path, None)
+        return [(OrderedDict(comment), unpack(graph))
+                for comment, graph in zip(comments, graphs)]
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    records = [(comment, parse(amr))
+               for comment, amr in iter_amrz_mapped(amr_filepath)]
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary file first so readers never see half an entry
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as cachefile:
+            marshal.dump(([list(comment.items()) for comment, graph in records],
+                          [pack(graph) for comment, graph in records]),
+                         cachefile)
+        os.replace(tmp_path, path)
+        evict(cache_dir)
+    except (IOError, OSError) as e:
+        print('Could not save parsed AMRs to the cache: %s' % e, file=sys.stderr)
+
+    return records
+
+
+if __name__ == "__main__":
+
+    opt = argparse.ArgumentParser(description='Manage the parsed AMR cache')
+    opt.add_argument('files', nargs='*',
+                     help='AMR files to clear or fill (default: the whole cache)')
+    opt.add_argument('--dir', default=CACHE_DIR, help='cache directory')
+    opt.add_argument('--clear', action='store_true',
+                     help='delete the cached graphs of the files, or of everything')
+    opt.add_argument('--fill', choices=sorted(PARSERS),
+                     help='parse the files with this parser and cache them')
+    opt.add_argument('--list', action='store_true', help='list cache entries')
+
+    args = opt.parse_args()
+
+    if args.clear:
+        if args.files:
+            removed = sum(clear_cache(f, args.dir) for f in args.files)
+        else:
+            removed = clear_cache(cache_dir=args.dir)
+        print('%d cache entries deleted' % removed)
+    if args.fill:
+        for amr_file in args.files:
+            load_parsed_amrs(amr_file, args.fill, args.dir)
+    if args.list:
+        for path, size, mtime in sorted(_entries(args.dir), key=lambda e: e[2]):
+            print('%10d %s' % (size, os.path.basename(path)))
@@ -0,0 +1,275 @@
+# -*- coding:utf-8 -*-
+
+'''
+random access into Chinese(zh) AMR corpus files
+
+A corpus is scanned once and the byte offset and length of every record
+are saved, keyed by its `::id`, in a sidecar index file next to the
+corpus. Lookups then seek straight to the record instead of reading the
+whole file again. The index is rebuilt whenever the size or modification
+time of the corpus no longer matches the one it was built from.
+
+Files can also be read through a read-only memory map, which finds the
+record boundaries on the raw bytes and only decodes the records in use.
+'''
+
+from __future__ import print_function
+import argparse
+import json
+import mmap
+import os
+import re
+import sys
+from collections import OrderedDict
+from preprocess import iter_amrz_lines
+
+# suffix of the sidecar index file
+INDEX_SUFFIX = '.idx'
+
+# bump this whenever the index layout changes
+INDEX_VERSION = 1
+
+
+def record_id(comment):
+    '''
+    sentence id of a record, e.g. "export_amr.1303" for the comment
+    line "# ::id export_amr.1303 ::2017-01-04 11:46:39"
+    '''
+    amr_id = comment.get('id')
+    if not amr_id:
+        return None
+    return amr_id.split()[0]
+
+
+class MappedCorpus(object):
+    """
+    Read-only memory map of an AMR corpus file.
+
+    Record boundaries (blank-line separators and `# ::` comment lines)
+    are found directly on the mapped bytes, and only the records that are
+    asked for are decoded. Processes mapping the same file share a single
+    page-cached copy of it.
+
+    >>> with MappedCorpus('data/amr_zh_all.txt.test.amr') as corpus:
+    ...     for comment, amr_string in corpus.records():
+    ...         pass
+    """
+
+    # one or more blank lines between records
+    SEPARATOR_RE = re.compile(br'\n(?:[ \t\r\f\v]*\n)+')
+    # a `# ::key value` comment line
+    COMMENT_RE = re.compile(br'(?m)^#[^\n]*::[^:\s]+\s')
+    # a line of the graph itself
+    GRAPH_LINE_RE = re.compile(br'(?m)^(?!#)[^\n]*[^\s]')
+    # the `::id` field of a comment line
+    ID_RE = re.compile(br'(?m)^#[^\n]*::id\s+([^\s]+)')
+
+    def __init__(self, amr_filepath):
+        self.amr_filepath = amr_filepath
+        self._file = open(amr_filepath, 'rb')
+        if os.fstat(self._file.fileno()).st_size:
+            self.data = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else:
+            # an empty file cannot be mapped
+            self.data = b''
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def spans(self):
+        """
+        Yield the (start, end) byte span of every record, in file order.
+        As in preprocess.iter_amrz, comment lines that are not followed by
+        a graph are carried over to the next record.
+        """
+        data = self.data
+        size = len(data)
+        start = None
+        has_comment = False
+        chunk_start = 0
+        while chunk_start < size:
+            separator = self.SEPARATOR_RE.search(data, chunk_start)
+            chunk_end = separator.start() if separator else size
+            if chunk_end > chunk_start:
+                if start is None:
+                    start = chunk_start
+                if not has_comment:
+                    has_comment = self.COMMENT_RE.search(
+                        data, chunk_start, chunk_end) is not None
+                if has_comment and self.GRAPH_LINE_RE.search(
+                        data, chunk_start, chunk_end) is not None:
+                    yield start, chunk_end
+                    start = None
+                    has_comment = False
+            chunk_start = separator.end() if separator else size
+
+    def record(self, start, end):
+        """Decode the span of one record into (comment, amr_string)"""
+        lines = self.data[start:end].decode('utf-8').split('\n')
+        for record in iter_amrz_lines(lines):
+            return record
+        return None
+
+    def record_id(self, start, end):
+        """Sentence id of a record, decoding only its comment lines"""
+        amr_id = None
+        for m in self.ID_RE.finditer(self.data, start, end):
+            amr_id = m.group(1).decode('utf-8')
+        return amr_id
+
+    def records(self):
+        """Yield every (comment, amr_string) record, decoding one at a time"""
+        for start, end in self.spans():
+            yield self.record(start, end)
+
+
+def iter_amrz_mapped(amr_filepath):
+    '''
+    memory-mapped drop-in for preprocess.iter_amrz
+    '''
+    with MappedCorpus(amr_filepath) as corpus:
+        for record in corpus.records():
+            yield record
+
+
+def scan_records(amr_filepath):
+    '''
+    scan a corpus once and yield (amr_id, offset, length) for every
+    record that has an id, in file order
+    '''
+    with MappedCorpus(amr_filepath) as corpus:
+        for start, end in corpus.spans():
+            amr_id = corpus.record_id(start, end)
+            if amr_id is not None:
+                yield amr_id, start, end - start
+
+
+class AMRIndex(object):
+    """
+    Byte offsets of the records in one AMR corpus file, keyed by sentence id.
+
+    >>> index = AMRIndex.load('data/amr_zh_all.txt.test.amr')
+    >>> comment, amr_string = index.get('export_amr.1303')
+    """
+
+    def __init__(self, amr_filepath, records=None, size=None, mtime=None):
+        self.amr_filepath = amr_filepath
+        # amr_id -> (offset, length), in file order
+        self.records = OrderedDict()
+        self.size = size
+        self.mtime = mtime
+        for amr_id, offset, length in records or []:
+            # keep the first record when an id is repeated
+            if amr_id not in self.records:
+                self.records[amr_id] = (offset, length)
+
+    @staticmethod
+    def index_path(amr_filepath):
+        return amr_filepath + INDEX_SUFFIX
+
+    @classmethod
+    def build(cls, amr_filepath, save=True):
+        """Scan the corpus and (optionally) write the sidecar index"""
+        stat = os.stat(amr_filepath)
+        index = cls(amr_filepath, scan_records(amr_filepath),
+                    stat.st_size, stat.st_mtime)
+        if save:
+            index.save()
+        return index
+
+    @classmethod
+    def load(cls, amr_filepath, rebuild=True):
+        """
+        Load the sidecar index of a corpus; a missing or stale index is
+        rebuilt (or None is returned if rebuild is False)
+        """
+        stat = os.stat(amr_filepath)
+        try:
+            with open(cls.index_path(amr_filepath)) as index_file:
+                saved = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            saved = None
+        if saved is not None and saved.get('version') == INDEX_VERSION and \
+                saved.get('size') == stat.st_size and \
+                saved.get('mtime') == stat.st_mtime:
+            return cls(amr_filepath, saved['records'],
+                       saved['size'], saved['mtime'])
+        if rebuild:
+            return cls.build(amr_filepath)
+        return None
+
+    def save(self):
+        """Write the sidecar index; a read-only corpus directory is not an error"""
+        saved = {
+            'version': INDEX_VERSION,
+            'size': self.size,
+            'mtime': self.mtime,
+            'records': [[amr_id, offset, length]
+                        for amr_id, (offset, length) in self.records.items()],
+        }
+        try:
+            with open(self.index_path(self.amr_filepath), 'w') as index_file:
+                json.dump(saved, index_file)
+        except (IOError, OSError) as e:
+            print('Could not save AMR index: %s' % e, file=sys.stderr)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, amr_id):
+        return amr_id in self.records
+
+    def ids(self):
+        return list(self.records.keys())
+
+    def get_raw(self, amr_id):
+        """Return the text of a record exactly as it appears in the corpus"""
+        offset, length = self.records[amr_id]
+        with open(self.amr_filepath, 'rb') as amrfile:
+            amrfile.seek(offset)
+            return amrfile.read(length).decode('utf-8')
+
+    def get(self, amr_id):
+        """Return the (comment, amr_string) record with the given id"""
+        raw = self.get_raw(amr_id)
+        for record in iter_amrz_lines(raw.splitlines(True)):
+            return record
+        raise KeyError(amr_id)
+
+
+def get_amr(amr_filepath, amr_id):
+    '''
+    fetch a single (comment, amr_string) record by id, building the
+    sidecar index on first use
+    '''
+    return AMRIndex.load(amr_filepath).get(amr_id)
+
+
+if __name__ == "__main__":
+
+    opt = argparse.ArgumentParser(
+        description='Index a Chinese AMR file and print records by id')
+    opt.add_argument('amr_file', help='chinese amr file')
+    opt.add_argument('ids', nargs='*', help='sentence ids to print')
+    opt.add_argument('--rebuild', action='store_true',
+                     help='rebuild the index even if it is up to date')
+
+    args = opt.parse_args()
+
+    if args.rebuild:
+        index = AMRIndex.build(args.amr_file)
+    else:
+        index = AMRIndex.load(args.amr_file)
+    print('%d records indexed in %s' %
+          (len(index), AMRIndex.index_path(args.amr_file)), file=sys.stderr)
+    for amr_id in args.ids:
+        print(index.get_raw(amr_id))
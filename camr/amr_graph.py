@@ -15,6 +15,7 @@ import re
 import sys
 import argparse
 import codecs
+import time
 
 
 DEBUG_LEVEL = 0
@@ -30,6 +31,36 @@ class ParserError(Exception):
     pass
 
 
+def make_compiled_regex(rules):
+    regexstr = '|'.join('(?P<%s>%s)' % (name, rule)
+                        for name, rule in rules)
+    return re.compile(regexstr)
+
+
+# lexer rules for AMRZ.parse_string, tried in order
+LEX_RULES = [
+    ("LPAR", r'\('),
+    ("RPAR", r'\)'),
+    ("COMMA", ','),
+    ("SLASH", '/'),
+    # chinese annotation has additional edge alignment
+    ("EDGELABEL", r":[^\s]+"),
+    ("STRLITERAL", u'"[^"]+"|\u201c[^\u201d]+\u201d'),
+    ("LITERAL", r"'[^\s(),]+"),
+    #("QUANTITY","[0-9][0-9Ee^+\-\.,:]*"),
+    ("IDENTIFIER", r"[^\s()]+")  # no blank within characters
+    #("POLARITY","\s\-\s")
+]
+
+# compiled once, shared by every parse
+TOKEN_RE = make_compiled_regex(LEX_RULES)
+
+# kinds of entries on the AMRZ.parse_string stack
+PNODE = 1
+CNODE = 2
+EDGE = 3
+
+
 class Node():
 
     # node_id = 0     #static counter, unique for each node
@@ -82,6 +113,46 @@ class AMRZ(defaultdict):
         self.edge_alignment = {}
         self.reentrance_triples = []
 
+    def to_tuple(self):
+        """
+        flatten the graph into plain tuples, lists and dicts (e.g. for marshal);
+        StrLiteral nodes become 1-tuples
+        """
+        def plain(node):
+            return ("".join(node),) if isinstance(node, StrLiteral) else node
+
+        edges = [(plain(n), [(rel, tuple(plain(c) for c in child))
+                             for rel, child in self[n]._key_value])
+                 for n in self]
+        return (self.roots, self.node_to_concepts, self.edge_alignment,
+                self.reentrance_triples, edges)
+
+    @classmethod
+    def from_tuple(cls, t):
+        """rebuild a graph flattened by to_tuple"""
+        def node(n):
+            return StrLiteral(n[0]) if type(n) is tuple else n
+
+        roots, node_to_concepts, edge_alignment, reentrance_triples, edges = t
+        amr = cls()
+        amr.roots = roots
+        amr.node_to_concepts = node_to_concepts
+        amr.edge_alignment = edge_alignment
+        amr.reentrance_triples = reentrance_triples
+        for n, key_value in edges:
+            # fill the ListMap in directly rather than through append()
+            listmap = ListMap()
+            listmap._key_value = [(rel, tuple([node(c) for c in child]))
+                                  for rel, child in key_value]
+            for rel, child in listmap._key_value:
+                if rel in listmap:
+                    dict.__getitem__(listmap, rel).append(child)
+                else:
+                    dict.__setitem__(listmap, rel, [child])
+                    listmap._keys.append(rel)
+            dict.__setitem__(amr, node(n), listmap)
+        return amr
+
     @classmethod
     def parse_string(cls, amr_string):
         """
@@ -91,15 +162,6 @@ class AMRZ(defaultdict):
         >>>
         """
 
-        def make_compiled_regex(rules):
-            regexstr = '|'.join('(?P<%s>%s)' % (name, rule)
-                                for name, rule in rules)
-            return re.compile(regexstr)
-
-        PNODE = 1
-        CNODE = 2
-        EDGE = 3
-
         amr = cls()
         stack = []
         state = 0
@@ -108,24 +170,7 @@ class AMRZ(defaultdict):
         node_idx = 0  # sequential new node index
         mapping_table = {}  # old new index mapping table
 
-        lex_rules = [
-            ("LPAR", '\('),
-            ("RPAR", '\)'),
-            ("COMMA", ','),
-            ("SLASH", '/'),
-            # chinese annotation has additional edge alignment
-            ("EDGELABEL", ":[^\s]+"),
-            ("STRLITERAL", u'"[^"]+"|\u201c[^\u201d]+\u201d'),
-            ("LITERAL", "'[^\s(),]+"),
-            #("QUANTITY","[0-9][0-9Ee^+\-\.,:]*"),
-            ("IDENTIFIER", "[^\s()]+")  # no blank within characters
-            #("POLARITY","\s\-\s")
-        ]
-
-        token_re = make_compiled_regex(lex_rules)
-        #lexer = Lexer(lex_rules)
-
-        for match in token_re.finditer(amr_string):
+        for match in TOKEN_RE.finditer(amr_string):
             token = match.group()
             type = match.lastgroup
 
@@ -332,7 +377,7 @@ class AMRZ(defaultdict):
                         stack.append((CNODE, parentnodelabel, parentconcept))
                     else:  # we have done with this subgraph
                         state = 0
-                        amr.roots.append(parentlabel)
+                        amr.roots.append(parentnodelabel)
 
             elif state == 6:
                 if type == "RPAR":
@@ -434,7 +479,7 @@ class AMRZ(defaultdict):
                 if type == "IDENTIFIER":
                     stack.append((CNODE, token, None))  # another children
                     state = 6
-                elif typpe == "LPAR":
+                elif type == "LPAR":
                     state = 1
                 else:
                     #raise ParserError, "Unexpected token %s" % (token)
@@ -444,6 +489,16 @@ class AMRZ(defaultdict):
 
         return amr
 
+    @classmethod
+    def parse_many(cls, amr_strings):
+        """
+        Parse an iterable of amr strings, yielding one amr per string.
+        All of them share the lexer compiled at import time (TOKEN_RE).
+        """
+        parse_string = cls.parse_string
+        for amr_string in amr_strings:
+            yield parse_string(amr_string)
+
     def _add_triple(self, parent, relation, child, warn=None):
         """
         Add a (parent, relation, child) triple to the DAG.
@@ -497,7 +552,10 @@ class AMRZ(defaultdict):
         to OrderedDefaultDict;
         """
         visited_nodes = set()
+        # visited_edges keeps the visiting order; the set is for membership tests
         visited_edges = []
+        visited_edge_set = set()
+        reentrance_triples = set(self.reentrance_triples)
         sequence = []
 
         for i, r in enumerate(self.roots):
@@ -509,9 +567,9 @@ class AMRZ(defaultdict):
             while stack:
                 next, rel, parent, depth, seqID = stack.pop()
                 for n in next:
-                    if self.reentrance_triples:
+                    if reentrance_triples:
                         firsthit = (
-                            parent, rel, n) not in self.reentrance_triples
+                            parent, rel, n) not in reentrance_triples
                     else:
                         firsthit = n not in visited_nodes
                     leaf = False if self[n] else True
@@ -522,22 +580,25 @@ class AMRZ(defaultdict):
                     sequence.append(node)
 
                     # same StrLiteral/Quantity/Polarity should not be revisited
-                    if self.reentrance_triples:  # for being the same with the amr string readed in
-                        if n in visited_nodes or (parent, rel, n) in self.reentrance_triples:
+                    if reentrance_triples:  # for being the same with the amr string readed in
+                        if n in visited_nodes or (parent, rel, n) in reentrance_triples:
                             continue
                     else:
                         if n in visited_nodes:
                             continue
 
                     visited_nodes.add(n)
-                    p = len([child for rel, child in self[n].items() if (
-                        n, rel, child[0]) not in self.reentrance_triples])
-                    for rel, child in reversed(self[n].items()):
+                    items = self[n].items()
+                    p = len([child for rel, child in items if (
+                        n, rel, child[0]) not in reentrance_triples])
+                    for rel, child in reversed(items):
                         # print rel,child
-                        if not (rel, n, child[0]) in visited_edges:
+                        edge = (rel, n, child[0])
+                        if edge not in visited_edge_set:
                             # if child[0] not in visited_nodes or isinstance(child[0],(StrLiteral,Quantity)):
-                            visited_edges.append((rel, n, child[0]))
-                            if (n, rel, child[0]) not in self.reentrance_triples:
+                            visited_edges.append(edge)
+                            visited_edge_set.add(edge)
+                            if (n, rel, child[0]) not in reentrance_triples:
                                 stack.append(
                                     (child, rel, n, depth + 1, seqID + '.' + str(p)))
                                 p -= 1
@@ -710,9 +771,15 @@ class AMRZ(defaultdict):
                 node_to_concepts[Node.node_id] = self.node_label
                 self.node_label = Node.node_id
 
-    def to_amr_string(self):
+    def iter_amr_fragments(self):
+        """
+        yield the amr string (Penman style) piece by piece, in the layout of
+        to_amr_string; ':' in concepts is written as '-'. The graph is not changed.
+        """
+        concepts = self.node_to_concepts
 
-        amr_string = ""
+        def concept(label):
+            return concepts[label].replace(':', '-')
 
         seq = self.dfs()[0]
 
@@ -720,48 +787,63 @@ class AMRZ(defaultdict):
         assert seq[0].trace == None
         dep_rec = 0
         for node in seq:
-            if node.node_label in self.node_to_concepts:
-                self.node_to_concepts[node.node_label] = self.node_to_concepts[node.node_label].replace(
-                    ':', '-')
             if node.trace == None:
-                if node.firsthit and node.node_label in self.node_to_concepts:
-                    amr_string += "(%s / %s" % (node.node_label,
-                                                self.node_to_concepts[node.node_label])
+                if node.firsthit and node.node_label in concepts:
+                    yield "(%s / %s" % (node.node_label, concept(node.node_label))
                 else:
-                    amr_string += "(%s" % (node.node_label)
+                    yield "(%s" % (node.node_label)
             else:
                 if node.depth >= dep_rec:
                     dep_rec = node.depth
                 else:
-                    amr_string += "%s" % ((dep_rec - node.depth) * ')')
+                    yield (dep_rec - node.depth) * ')'
                     dep_rec = node.depth
 
                 if not node.leaf:
-                    if node.firsthit and node.node_label in self.node_to_concepts:
-                        amr_string += "\n%s:%s (%s / %s" % (node.depth * "\t", node.trace,
-                                                            node.node_label, self.node_to_concepts[node.node_label])
+                    if node.firsthit and node.node_label in concepts:
+                        yield "\n%s:%s (%s / %s" % (node.depth * "\t", node.trace,
+                                                     node.node_label, concept(node.node_label))
                     else:
-                        amr_string += "\n%s:%s %s" % (node.depth *
-                                                      "\t", node.trace, node.node_label)
+                        yield "\n%s:%s %s" % (node.depth * "\t", node.trace, node.node_label)
 
                 else:
-                    if node.firsthit and node.node_label in self.node_to_concepts:
-                        amr_string += "\n%s:%s (%s / %s)" % (node.depth * "\t", node.trace,
-                                                             node.node_label, self.node_to_concepts[node.node_label])
+                    if node.firsthit and node.node_label in concepts:
+                        yield "\n%s:%s (%s / %s)" % (node.depth * "\t", node.trace,
+                                                      node.node_label, concept(node.node_label))
                     else:
                         if isinstance(node.node_label, StrLiteral):
-                            amr_string += '\n%s:%s "%s"' % (
-                                node.depth * "\t", node.trace, node.node_label)
+                            yield '\n%s:%s "%s"' % (node.depth * "\t", node.trace, node.node_label)
                         else:
-                            amr_string += "\n%s:%s %s" % (
-                                node.depth * "\t", node.trace, node.node_label)
+                            yield "\n%s:%s %s" % (node.depth * "\t", node.trace, node.node_label)
 
         if dep_rec != 0:
-            amr_string += "%s" % ((dep_rec) * ')')
+            yield dep_rec * ')'
         else:
-            amr_string += ')'
+            yield ')'
 
-        return amr_string
+    def to_amr_string(self):
+        return ''.join(self.iter_amr_fragments())
+
+    def write_amr(self, fp):
+        """write the amr string to the file-like object fp, without building it in memory"""
+        fp.writelines(self.iter_amr_fragments())
+
+
+def benchmark_parse(amr_strings, repeat=3):
+    '''
+    time AMRZ.parse_many over amr_strings; returns the best per-graph
+    parse time in seconds over repeat runs
+    '''
+    amr_strings = list(amr_strings)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for amr in AMRZ.parse_many(amr_strings):
+            pass
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / max(len(amr_strings), 1)
 
 
 if __name__ == "__main__":
@@ -769,9 +851,18 @@ if __name__ == "__main__":
     opt = argparse.ArgumentParser()
     opt.add_argument("-v", action="store_true", dest="verbose")
     opt.add_argument("-f", "--files", nargs='?', help='chinese amr file')
+    opt.add_argument("--bench", action="store_true",
+                     help='time parsing the amrs of the file instead of printing them')
 
     args = opt.parse_args()
 
+    if args.bench:
+        from preprocess import iter_amrz
+        amr_strings = [amr_str for comment, amr_str in iter_amrz(args.files)]
+        per_graph = benchmark_parse(amr_strings)
+        print('%d amrs, %.1f us per graph' % (len(amr_strings), per_graph * 1e6))
+        sys.exit(0)
+
     # s = '''(a / and :op1(恶化 :ARG0(它) :ARG1(模式 :mod(开发)) :time (已经)) :op2(t / 堵塞 :ARG0(它) :ARG1(交通 :mod(局部)) :location(a / around :op1(出口))))'''
     # s1 = '''(a  /  and :op1 (c  /  change-01 :ARG0 (i  /  it) :ARG1 (p  /  pattern :mod (d  /  develop-02)) :ARG2 (b  / bad :degree (m  /  more))) :op2 (c2  /  cause-01 :ARG0 i :ARG1 (c3  /  congest-01 :ARG1 (a2  /  around :op1 (e  /  exit :poss i)) :ARG2 (t  /  traffic) :ARG1-of (l2  /  localize-01))) :time (a3  /  already))'''
 
@@ -0,0 +1,138 @@
+# -*- coding:utf-8 -*-
+
+'''
+regression check of AMRZ.dfs
+
+AMRZ.dfs keeps its visited edges and reentrance triples in sets for the
+membership tests. reference_dfs below is the traversal as it was before,
+with the same tests done on lists; for every graph in the given AMR files
+both must give the same (sequence, visited_edges).
+
+    python camr/check_amrz_dfs.py              # all the files in data/
+    python camr/check_amrz_dfs.py FILE [FILE ...]
+
+Exits with status 1 if any graph differs.
+'''
+
+from __future__ import print_function
+import argparse
+import glob
+import os
+import sys
+
+from amr_corpus import iter_amrz_mapped
+from amr_graph import AMRZ, Node, StrLiteral, Quantity
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'data')
+
+
+def reference_dfs(amr):
+    '''
+    AMRZ.dfs before the set-based membership tests
+    '''
+    visited_nodes = set()
+    visited_edges = []
+    sequence = []
+
+    for i, r in enumerate(amr.roots):
+        seqID = str(i + 1)
+        stack = [((r,), None, None, 0, seqID)]
+
+        while stack:
+            next, rel, parent, depth, seqID = stack.pop()
+            for n in next:
+                if amr.reentrance_triples:
+                    firsthit = (
+                        parent, rel, n) not in amr.reentrance_triples
+                else:
+                    firsthit = n not in visited_nodes
+                leaf = False if amr[n] else True
+
+                node = Node(parent, rel, n, firsthit, leaf, depth, seqID)
+                sequence.append(node)
+
+                if amr.reentrance_triples:
+                    if n in visited_nodes or (parent, rel, n) in amr.reentrance_triples:
+                        continue
+                else:
+                    if n in visited_nodes:
+                        continue
+
+                visited_nodes.add(n)
+                p = len([child for rel, child in amr[n].items() if (
+                    n, rel, child[0]) not in amr.reentrance_triples])
+                for rel, child in reversed(amr[n].items()):
+                    if not (rel, n, child[0]) in visited_edges:
+                        visited_edges.append((rel, n, child[0]))
+                        if (n, rel, child[0]) not in amr.reentrance_triples:
+                            stack.append(
+                                (child, rel, n, depth + 1, seqID + '.' + str(p)))
+                            p -= 1
+                        else:
+                            stack.append((child, rel, n, depth + 1, None))
+                    elif isinstance(child[0], (StrLiteral, Quantity)):
+                        stack.append(
+                            (child, rel, n, depth + 1, seqID + '.' + str(p)))
+                        p -= 1
+                    else:
+                        p -= 1
+
+    return (sequence, visited_edges)
+
+
+def node_fields(node):
+    '''everything a Node of dfs records'''
+    return (node.parent, node.trace, node.node_label, node.firsthit,
+            node.leaf, node.depth, node.seqID)
+
+
+def dfs_fields(result):
+    '''comparable form of a (sequence, visited_edges) result'''
+    sequence, visited_edges = result
+    return [node_fields(node) for node in sequence], visited_edges
+
+
+def check_file(amr_filepath):
+    '''
+    compare AMRZ.dfs with reference_dfs on every graph of a file that
+    AMRZ.parse_string accepts
+    Returns:
+        (graphs compared, graphs skipped, ids or positions of the graphs
+        that differ)
+    '''
+    compared = 0
+    skipped = 0
+    differ = []
+    for i, (comment, amr_string) in enumerate(iter_amrz_mapped(amr_filepath)):
+        try:
+            amr = AMRZ.parse_string(amr_string)
+        except Exception:
+            skipped += 1
+            continue
+        compared += 1
+        if dfs_fields(amr.dfs()) != dfs_fields(reference_dfs(amr)):
+            differ.append(comment.get('id') or str(i + 1))
+    return compared, skipped, differ
+
+
+if __name__ == '__main__':
+
+    opt = argparse.ArgumentParser(
+        description='Check that AMRZ.dfs gives the same nodes and edges as '
+                    'the list-based traversal it replaced')
+    opt.add_argument('files', nargs='*',
+                     help='AMR files (Default: the .amr and .parsed files in data/)')
+    args = opt.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(DATA_DIR, '*.amr')) +
+                                 glob.glob(os.path.join(DATA_DIR, '*.parsed')))
+    failed = False
+    for amr_filepath in files:
+        compared, skipped, differ = check_file(amr_filepath)
+        print('%s: %d graphs, %d not parsed, %d differ' %
+              (os.path.basename(amr_filepath), compared, skipped, len(differ)))
+        for amr_id in differ:
+            print('  %s' % amr_id)
+        failed = failed or bool(differ)
+    sys.exit(1 if failed else 0)
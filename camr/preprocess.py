@@ -19,62 +19,65 @@ log = sys.stdout
 # SKIP_FNAME='log/skipped_file_list_v10k.txt'
 # SKIP_CMD_FNAME='scripts/skip-files-10k.sh'
 
+# `::key value` fields on an AMR comment line
+COMMENT_FIELD_RE = re.compile(r"::([^:\s]+)\s((?<!::).*)")
+
+
+def iter_amrz_lines(lines):
+    '''
+    group the lines of a Chinese(zh) AMR file into records
+
+    yields (comment, amr_string) pairs, where comment maps the `::key`
+    fields of the comment lines to their values and amr_string is the
+    graph joined onto a single line
+    '''
+    comment = OrderedDict()
+    amr_lines = []
+
+    for line in lines:
+
+        if line.startswith('#'):
+            for m in COMMENT_FIELD_RE.finditer(line):
+                comment[m.group(1)] = m.group(2).strip()
+
+        elif not line.strip():
+            if amr_lines and comment:
+                yield comment, ' '.join(amr_lines)
+                amr_lines = []
+                comment = OrderedDict()
+        else:
+            amr_lines.append(line.strip())
+
+    if amr_lines and comment:
+        yield comment, ' '.join(amr_lines)
+
+
+def iter_amrz(amr_filepath):
+    '''
+    stream Chinese(zh) AMR records one at a time; only the current
+    record is held in memory
+    '''
+    with codecs.open(amr_filepath, 'r', encoding='utf-8') as amrfile:
+        for record in iter_amrz_lines(amrfile):
+            yield record
+
 
 def read_amrz(amr_filepath):
     '''
     read Chinese(zh) AMR
     '''
     comment_list = []
-    comment = OrderedDict()
     amr_list = []
-    amr_string = ''
-    orig_index = 0
-    skipped_id_list = []
 
     print('Reading zh amr:')
-    with codecs.open(amr_filepath, 'r', encoding='utf-8') as amrfile:
-         # codecs.open(SKIP_FNAME, 'w', encoding='utf8') as skipped_f, \
-         # open(SKIP_CMD_FNAME, 'w') as skipped_cmd_f:
-
-        for line in amrfile:
-
-            if line.startswith('#'):
-                for m in re.finditer("::([^:\s]+)\s((?<!::).*)", line):
-                    # print m.group(1),m.group(2)
-                    key = m.group(1)
-                    if key in comment and key == 'id':  # skipped sentences
-                        orig_index += 1
-                        # skipped_id_list.append(orig_index)
-                        # print('%d -- %s' % (orig_index, comment[key]), file=skipped_f)
-
-                    comment[key] = m.group(2).strip()
-
-            elif not line.strip():
-                if amr_string and comment:
-                    orig_index += 1
-                    comment_list.append(comment)
-                    amr_list.append(amr_string.strip())
-                    curr_num = len(amr_list)
-                    if curr_num > 0 and curr_num % 1000 == 0:
-                        print('%d...' % curr_num, end='')
-                        sys.stdout.flush()
-
-                    amr_string = ''
-                    comment = {}
-            else:
-                amr_string += line.strip() + ' '
-
-        if amr_string and comment:
-            comment_list.append(comment)
-            amr_list.append(amr_string)
-        if not amr_string and comment:
-            orig_index += 1
-            # skipped_id_list.append(orig_index)
-            # print('%d -- %s' % (orig_index, comment['id']), file=skipped_f)
-        # cmd = 'sed -e \'%s\' $1' % (';'.join(str(sid)+'d' for sid in skipped_id_list))
-        # skipped_cmd_f.write(cmd+'\n')
-
-        print('\n')
+    for comment, amr_string in iter_amrz(amr_filepath):
+        comment_list.append(comment)
+        amr_list.append(amr_string)
+        curr_num = len(amr_list)
+        if curr_num % 1000 == 0:
+            print('%d...' % curr_num, end='')
+            sys.stdout.flush()
+    print('\n')
 
     return (comment_list, amr_list)
 
@@ -104,7 +107,21 @@ def _write_tok_sentences(file_path, toks, comments=None):
                 output_tok.write("%s\n" % sent)
 
 
-def _write_amrs(amr_strings, comments, amr_file, split=None):
+def _parse_amrs(amr_file, amr_strings, use_amr_cache=False):
+    '''
+    parse amr_strings (read from amr_file) into AMRZ graphs, or load them
+    from the on-disk cache of amr_cache; every call returns new graphs
+    '''
+    if use_amr_cache:
+        # amr_cache reads files with amr_corpus, which imports this module
+        from amr_cache import load_parsed_amrs
+        return iter([amr for comment, amr in load_parsed_amrs(amr_file, 'amrz')])
+    return (AMRZ.parse_string(amr_str) for amr_str in amr_strings)
+
+
+def _write_amrs(amr_strings, comments, amr_file, split=None, amrs=None):
+    if amrs is None:
+        amrs = (AMRZ.parse_string(amr_str) for amr_str in amr_strings)
     out_amr_file = amr_file + '.amr'
     if split:
         endp1, endp2 = split
@@ -115,39 +132,38 @@ def _write_amrs(amr_strings, comments, amr_file, split=None):
         with codecs.open(out_amr_file, 'w', encoding='utf-8') as output, \
                 codecs.open(out_dev_amr_file, 'w', encoding='utf-8') as doutput,\
                 codecs.open(out_test_amr_file, 'w', encoding='utf-8') as toutput:
-            for i, (amr_str, comment) in enumerate(zip(amr_strings, comments)):
-                newamr = AMRZ.parse_string(amr_str)
+            for i, (newamr, comment) in enumerate(zip(amrs, comments)):
                 misc_str = '# %s\n' % (' '.join(('::%s %s') % (k, v) for k, v in comment.items(
                 ) if k in ['id', 'date', 'snt-type', 'annotator']))
                 tok_str = '# %s\n' % (' '.join(('::%s %s') % (
                     k, v) for k, v in comment.items() if k in ['snt', 'tok']))
-                newamr_str = newamr.to_amr_string()
+                # serialized once, written to both outputs
+                newamr_fragments = list(newamr.iter_amr_fragments())
                 if i < endp1:
                     doutput.write(misc_str)
                     doutput.write(tok_str)
-                    doutput.write(newamr_str)
+                    doutput.writelines(newamr_fragments)
                     doutput.write('\n\n')
                 elif i >= endp1 and i < endp2:
                     toutput.write(misc_str)
                     toutput.write(tok_str)
-                    toutput.write(newamr_str)
+                    toutput.writelines(newamr_fragments)
                     toutput.write('\n\n')
 
                 output.write(misc_str)
                 output.write(tok_str)
-                output.write(newamr_str)
+                output.writelines(newamr_fragments)
                 output.write('\n\n')
     else:
         print('Writing amrs to file %s' % (out_amr_file), file=log)
         with codecs.open(out_amr_file, 'w', encoding='utf-8') as output:
-            for amr_str, comment in zip(amr_strings, comments):
-                newamr = AMRZ.parse_string(amr_str)
+            for newamr, comment in zip(amrs, comments):
                 output.write('# %s\n' % (' '.join(('::%s %s') % (k, v) for k, v in comment.items(
                 ) if k in ['id', 'date', 'snt-type', 'annotator'])))
                 output.write('# %s\n' % (' '.join(('::%s %s') % (k, v)
                                                   for k, v in comment.items() if k in ['snt', 'tok'])))
 
-                output.write(newamr.to_amr_string())  # reformat the amr
+                newamr.write_amr(output)  # reformat the amr
                 output.write('\n\n')
 
 
@@ -158,7 +174,7 @@ def _word_ner_iter(ner_file):
                 yield wn.strip()
 
 
-def preprocess(input_file, START_SNLP=False, INPUT_AMR='amr', DEBUG_LEVEL=0, ALIGN_FORMAT='gold', split=None, use_gold_dep=False):
+def preprocess(input_file, START_SNLP=False, INPUT_AMR='amr', DEBUG_LEVEL=0, ALIGN_FORMAT='gold', split=None, use_gold_dep=False, use_amr_cache=False):
     instances = []
 
     if INPUT_AMR == 'amr':  # input is annotation
@@ -180,7 +196,8 @@ def preprocess(input_file, START_SNLP=False, INPUT_AMR='amr', DEBUG_LEVEL=0, ALI
             _write_sentences(tmp_tok_filename, toks)
 
         if not os.path.exists(tmp_amr_filename):
-            _write_amrs(amr_strings, comments, amr_file, split=split)
+            _write_amrs(amr_strings, comments, amr_file, split=split,
+                        amrs=_parse_amrs(amr_file, amr_strings, use_amr_cache))
 
         if START_SNLP:
             print("Start preprocessing ...", file=log)
@@ -201,6 +218,7 @@ def preprocess(input_file, START_SNLP=False, INPUT_AMR='amr', DEBUG_LEVEL=0, ALI
             external_alignments = external_align_file.readlines()
             external_align_file.close()
 
+        amrs = _parse_amrs(amr_file, amr_strings, use_amr_cache)
         word_counter = 0
         Data.reset()  # reset counter
         print('Preprocessing:')
@@ -249,7 +267,7 @@ def preprocess(input_file, START_SNLP=False, INPUT_AMR='amr', DEBUG_LEVEL=0, ALI
                 dep_line = dep_file.next().strip()
 
             # add amr graph
-            amr = AMRZ.parse_string(amr_strings[i])
+            amr = next(amrs)
             data.addAMR(amr)
 
             ggraph = None
@@ -378,10 +396,13 @@ if __name__ == "__main__":
                      default=0, help='input amr format')
     opt.add_argument("-f", "--file", nargs='?', help='input file')
     opt.add_argument("-slt", "--split", default='1264;2541', help='input file')
+    opt.add_argument("--amr-cache", action='store_true',
+                     help='load parsed amrs from the on-disk cache (see amr_cache.py)')
 
     args = opt.parse_args()
     split = [int(i) for i in args.split.split(';')] if args.split else None
     instances = preprocess(args.file, START_SNLP=args.startprep,
-                           INPUT_AMR=args.amrfmt, DEBUG_LEVEL=args.debuglevel, ALIGN_FORMAT=args.alignfmt, split=split)
+                           INPUT_AMR=args.amrfmt, DEBUG_LEVEL=args.debuglevel, ALIGN_FORMAT=args.alignfmt, split=split,
+                           use_amr_cache=args.amr_cache)
     # for inst in instances:
     #    print(inst.to_string())
@@ -0,0 +1,230 @@
+# -*- coding:utf-8 -*-
+
+'''
+paired bootstrap significance of corpus-level scores
+
+A corpus score (e.g. the smatch F-score) is computed from counts summed
+over the sentences, e.g. (matched, test, gold) triples. The counts of
+each sentence are computed once per system; a bootstrap sample then only
+re-weights the sentences. All systems share the same samples, so every
+pair of systems is compared on the same resampled corpora (a paired
+test), and the resampled totals of a batch of samples are a single
+matrix product of the sample weights with the count arrays.
+
+>>> counts = [smatch_counts(f, GOLD_TEST) for f in (BASIC_TEST, SIBLING_TEST)]
+>>> observed, resampled = bootstrap_scores(counts, samples=10000, seed=1)
+>>> print(paired_comparison(observed, resampled, 0, 1).format('basic', 'sibling'))
+'''
+
+from __future__ import print_function
+import argparse
+import itertools
+import os
+import sys
+
+import numpy as np
+
+import smatch
+
+
+def f_score(totals):
+    '''
+    F-score of summed (matched, test, gold) counts, as smatch.compute_f
+    Inputs:
+        totals: array whose last axis holds (matched, test, gold) and
+            possibly more counts, which are ignored
+    Returns:
+        array of F-scores, one per row of totals
+    '''
+    totals = np.asarray(totals, dtype=np.float64)
+    match, test, gold = totals[..., 0], totals[..., 1], totals[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(test > 0, match / test, 0.0)
+        recall = np.where(gold > 0, match / gold, 0.0)
+        f = np.where(precision + recall > 0,
+                     2 * precision * recall / (precision + recall), 0.0)
+    return f
+
+
+def column_total(column):
+    '''statistic that is the total of one count column'''
+    def total(totals):
+        return np.asarray(totals, dtype=np.float64)[..., column]
+    return total
+
+
+def bootstrap_scores(count_arrays, statistic=f_score, samples=1000, seed=None,
+                     batch_size=1000):
+    '''
+    Score systems on the whole corpus and on bootstrap samples of it
+    Inputs:
+        count_arrays: one (sentences, k) array of per-sentence counts per
+            system, all over the same sentences
+        statistic: function from summed counts (last axis k) to a score
+        samples: number of bootstrap samples
+        seed: seed of the sample generator (None: system randomness)
+        batch_size: number of samples drawn at a time
+    Returns:
+        observed: (systems,) score of each system on the corpus
+        resampled: (systems, samples) score of each system on each sample
+    '''
+    count_arrays = [np.asarray(c, dtype=np.float64) for c in count_arrays]
+    sentence_num = len(count_arrays[0])
+    for counts in count_arrays:
+        if len(counts) != sentence_num:
+            raise ValueError('systems are scored on different numbers of '
+                             'sentences: %d and %d' % (sentence_num, len(counts)))
+    # (sentences, systems * k), so one product sums every system at once
+    stacked = np.concatenate(count_arrays, axis=1)
+    width = count_arrays[0].shape[1]
+    observed = np.array([statistic(c.sum(axis=0)) for c in count_arrays])
+    resampled = np.empty((len(count_arrays), samples))
+    rng = np.random.RandomState(seed)
+    uniform = np.full(sentence_num, 1.0 / sentence_num)
+    for start in range(0, samples, batch_size):
+        size = min(batch_size, samples - start)
+        # how many times each sentence is drawn in each sample
+        weights = rng.multinomial(sentence_num, uniform, size=size)
+        totals = weights.astype(np.float64).dot(stacked)
+        for s in range(len(count_arrays)):
+            resampled[s, start:start + size] = \
+                statistic(totals[:, s * width:(s + 1) * width])
+    return observed, resampled
+
+
+class PairedComparison(object):
+    """
+    Paired bootstrap comparison of two systems.
+
+    Members:
+        score_a, score_b: corpus scores of the two systems
+        delta: score_b - score_a
+        ci_a, ci_b, ci_delta: (low, high) percentile confidence intervals
+        p_value: two-sided p-value of delta under the null hypothesis that
+            the systems are equally good: the share of samples whose delta
+            is at least as far from the observed delta as the observed
+            delta is from 0
+        samples: number of bootstrap samples
+    """
+
+    def __init__(self, score_a, score_b, ci_a, ci_b, ci_delta, p_value,
+                 samples):
+        self.score_a = score_a
+        self.score_b = score_b
+        self.delta = score_b - score_a
+        self.ci_a = ci_a
+        self.ci_b = ci_b
+        self.ci_delta = ci_delta
+        self.p_value = p_value
+        self.samples = samples
+
+    def format(self, name_a, name_b, precision=4):
+        '''one line report, e.g. "a vs b: 0.5663 [...] vs 0.5745 [...], ..."'''
+        number = '%.{}f'.format(precision)
+        interval = '[{0}, {0}]'.format(number)
+        delta = '%+.{}f'.format(precision)
+        return ('{} vs {}: ' + number + ' ' + interval + ' vs ' + number +
+                ' ' + interval + ', difference ' + delta + ' ' + interval +
+                ', p = %.4f').format(name_a, name_b) % (
+            self.score_a, self.ci_a[0], self.ci_a[1],
+            self.score_b, self.ci_b[0], self.ci_b[1],
+            self.delta, self.ci_delta[0], self.ci_delta[1], self.p_value)
+
+
+def paired_comparison(observed, resampled, a, b, alpha=0.05):
+    '''
+    Compare systems a and b of bootstrap_scores
+    Inputs:
+        observed, resampled: results of bootstrap_scores
+        a, b: indices of the two systems
+        alpha: the confidence intervals cover 1 - alpha
+    Returns:
+        PairedComparison
+    '''
+    percentiles = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    deltas = resampled[b] - resampled[a]
+    delta = observed[b] - observed[a]
+    # shifted to the null hypothesis: the samples spread around 0
+    extreme = np.sum(np.abs(deltas - delta) >= abs(delta))
+    p_value = (extreme + 1.0) / (len(deltas) + 1.0)
+    return PairedComparison(
+        float(observed[a]), float(observed[b]),
+        tuple(np.percentile(resampled[a], percentiles)),
+        tuple(np.percentile(resampled[b], percentiles)),
+        tuple(np.percentile(deltas, percentiles)),
+        p_value, len(deltas))
+
+
+def compare_all(names, count_arrays, statistic=f_score, samples=1000,
+                seed=None, alpha=0.05, precision=4):
+    '''
+    Paired comparison of every pair of systems
+    Inputs:
+        names: name of each system
+        count_arrays, statistic, samples, seed: see bootstrap_scores
+        alpha: see paired_comparison
+        precision: decimals in the report lines
+    Returns:
+        list of report lines, one per pair of systems
+    '''
+    observed, resampled = bootstrap_scores(count_arrays, statistic, samples,
+                                           seed)
+    return [paired_comparison(observed, resampled, a, b, alpha).format(
+                names[a], names[b], precision)
+            for a, b in itertools.combinations(range(len(names)), 2)]
+
+
+def smatch_counts(test_filepath, gold_filepath, jobs=1, seed=0):
+    '''
+    Per-sentence smatch counts of a test file against a gold file
+    Inputs:
+        test_filepath, gold_filepath: AMR files, one AMR per sentence in
+            the same order
+        jobs: number of worker processes (see smatch.score_amr_pairs)
+        seed: smatch random seed, so the counts are repeatable
+    Returns:
+        (sentences, 3) array of (best match, test triples, gold triples)
+    '''
+    with open(test_filepath) as test_file, open(gold_filepath) as gold_file:
+        pairs = smatch.iter_amr_pairs(test_file, gold_file)
+        return np.array(list(smatch.score_amr_pairs(pairs, jobs, seed=seed)),
+                        dtype=np.int64).reshape(-1, 3)
+
+
+if __name__ == "__main__":
+
+    opt = argparse.ArgumentParser(
+        description='Paired bootstrap significance of smatch F-scores '
+                    'between systems')
+    opt.add_argument('gold', help='gold amr file')
+    opt.add_argument('systems', nargs='+', help='parsed amr files to compare')
+    opt.add_argument('--samples', type=int, default=10000,
+                     help='number of bootstrap samples (Default: 10000)')
+    opt.add_argument('--seed', type=int, default=1,
+                     help='seed of smatch and of the bootstrap (Default: 1)')
+    opt.add_argument('--alpha', type=float, default=0.05,
+                     help='confidence intervals cover 1 - alpha (Default: 0.05)')
+    opt.add_argument('--jobs', type=int, default=1,
+                     help='worker processes for smatch (Default: 1)')
+    opt.add_argument('-r', type=int, default=4,
+                     help='smatch restart number (Default: 4)')
+    opt.add_argument('--engine', choices=smatch.ENGINES, default='numpy',
+                     help='smatch hill-climbing implementation (Default: numpy)')
+
+    args = opt.parse_args()
+    if len(args.systems) < 2:
+        print('Give at least two systems to compare', file=sys.stderr)
+        sys.exit(1)
+
+    smatch.iteration_num = args.r + 1
+    smatch.engine = args.engine
+    names = [os.path.basename(f) for f in args.systems]
+    counts = []
+    for system in args.systems:
+        print('Scoring %s' % system, file=sys.stderr)
+        counts.append(smatch_counts(system, args.gold, args.jobs, args.seed))
+    print('Smatch F-score, paired bootstrap with %d samples against %s' %
+          (args.samples, args.gold))
+    for line in compare_all(names, counts, samples=args.samples,
+                            seed=args.seed, alpha=args.alpha):
+        print(line)
@@ -9,11 +9,16 @@ For detailed description of smatch, see http://www.isi.edu/natural-language/amr/
 """
 
 import amr
+import hashlib
+import marshal
+import multiprocessing
 import os
 import random
 import sys
 import time
 
+import numpy as np
+
 # total number of iteration in smatch computation
 iteration_num = 5
 
@@ -29,16 +34,53 @@ single_score = True
 # Default false (do not output precision and recall, just output F score)
 pr_flag = False
 
+# hill-climbing implementation: "python" (dictionary based) or "numpy" (vectorized).
+# Both find the same best match for the same random initializations.
+engine = "python"
+
+# available hill-climbing implementations
+ENGINES = ("python", "numpy")
+
+# random seed for the initial mappings.
+# Default None (seed from system randomness, so repeated runs may differ)
+random_seed = None
+
+# number of worker processes for the hill-climbing runs of one AMR pair.
+# Default 1 (run them one after another)
+restart_job_num = 1
+
+# only pairs with at least this many nodes in one AMR have their runs spread over workers;
+# for smaller pairs starting the workers costs more than the runs themselves
+restart_min_nodes = 100
+
+# pairs whose AMRs have at most this many nodes are matched exactly (by exact_best_match)
+# instead of by hill-climbing. Default 0 (always hill-climb)
+exact_max_nodes = 0
+
+# search nodes the exact match may visit for one pair before it settles for the best mapping so far
+exact_max_steps = 100000
+
+# check the match number kept by the hill-climbing against a full recomputation after every step.
+# Default false (trust the incremental bookkeeping)
+debug_match = False
+
+# module settings the worker processes of score_amr_pairs and run_parallel_restarts take over
+# from the parent (with spawn or forkserver they would otherwise start from the defaults)
+WORKER_SETTINGS = ("verbose", "iteration_num", "engine", "restart_min_nodes", "exact_max_nodes",
+                   "exact_max_steps", "debug_match")
+
+# suffix of the sidecar file keeping the gold triples and per-sentence results (see SentenceCache)
+SENTENCE_CACHE_SUFFIX = ".smatch"
+
+# bump this whenever the layout of the sentence cache changes
+SENTENCE_CACHE_VERSION = 2
+
 # Error log location
 ERROR_LOG = sys.stderr
 
 # Debug log location
 DEBUG_LOG = sys.stderr
 
-# dictionary to save pre-computed node mapping and its resulting triple match count
-# key: tuples of node mapping
-# value: the matching triple count
-match_triple_dict = {}
 
 
 def get_amr_line(input_f):
@@ -83,6 +125,35 @@ def build_arg_parser():
                              'instead of a single document-level smatch score (Default: false)')
     parser.add_argument('--pr', action='store_true', default=False,
                         help="Output precision and recall as well as the f-score. Default: false")
+    parser.add_argument('--bench', action='store_true', default=False,
+                        help="Time the candidate pool construction instead of scoring. Default: false")
+    parser.add_argument('--engine', choices=ENGINES, default="python",
+                        help="Hill-climbing implementation (Default: python)")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Random seed, for repeatable scores (Default: none)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of worker processes scoring AMR pairs (Default: 1)")
+    parser.add_argument('--restart-jobs', type=int, default=1,
+                        help="Number of worker processes running the restarts of one large AMR pair (Default: 1)")
+    parser.add_argument('--restart-min-nodes', type=int, default=100,
+                        help="Minimum node number of a pair for --restart-jobs to apply (Default: 100)")
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help="Print the numbers of hill-climbing restarts run and skipped to stderr " \
+                             "(Default: false)")
+    parser.add_argument('--sentence-cache', action='store_true', default=False,
+                        help="Keep the gold triples and per-sentence scores in a sidecar of the gold " \
+                             "(second) file, rescore only the sentences that changed and report " \
+                             "the changes since the last run; scores are only cached with --seed " \
+                             "(Default: false)")
+    parser.add_argument('--debug-match', action='store_true', default=False,
+                        help="Check every hill-climbing step against a full recomputation of the " \
+                             "match number (Default: false)")
+    parser.add_argument('--exact-max-nodes', type=int, default=0,
+                        help="After hill-climbing, search pairs of at most this many nodes for " \
+                             "the exact best match; about 20 is fast (Default: 0, never)")
+    parser.add_argument('--exact-max-steps', type=int, default=100000,
+                        help="Search steps of one exact match before it keeps the best mapping " \
+                             "found so far (Default: 100000)")
     return parser
 
 
@@ -103,13 +174,46 @@ def build_arg_parser2():
                            'a single document-level smatch score (Default: False)')
     parser.add_option('--pr', "--precision_recall", action='store_true', dest="pr",
                       help="Output precision and recall as well as the f-score. Default: false")
-    parser.set_defaults(r=4, v=False, ms=False, pr=False)
+    parser.add_option('--bench', action='store_true', dest="bench",
+                      help="Time the candidate pool construction instead of scoring. Default: false")
+    parser.add_option('--engine', type="choice", choices=ENGINES, dest="engine",
+                      help="Hill-climbing implementation (Default: python)")
+    parser.add_option('--seed', type="int", dest="seed",
+                      help="Random seed, for repeatable scores (Default: none)")
+    parser.add_option('--jobs', type="int", dest="jobs",
+                      help="Number of worker processes scoring AMR pairs (Default: 1)")
+    parser.add_option('--restart-jobs', type="int", dest="restart_jobs",
+                      help="Number of worker processes running the restarts of one large AMR pair (Default: 1)")
+    parser.add_option('--restart-min-nodes', type="int", dest="restart_min_nodes",
+                      help="Minimum node number of a pair for --restart-jobs to apply (Default: 100)")
+    parser.add_option('--stats', action='store_true', dest="stats",
+                      help="Print the numbers of hill-climbing restarts run and skipped to stderr " \
+                           "(Default: false)")
+    parser.add_option('--sentence-cache', action='store_true', dest="sentence_cache",
+                      help="Keep the gold triples and per-sentence scores in a sidecar of the gold " \
+                           "(second) file, rescore only the sentences that changed and report " \
+                           "the changes since the last run; scores are only cached with --seed " \
+                           "(Default: false)")
+    parser.add_option('--debug-match', action='store_true', dest="debug_match",
+                      help="Check every hill-climbing step against a full recomputation of the " \
+                           "match number (Default: false)")
+    parser.add_option('--exact-max-nodes', type="int", dest="exact_max_nodes",
+                      help="After hill-climbing, search pairs of at most this many nodes for " \
+                           "the exact best match; about 20 is fast (Default: 0, never)")
+    parser.add_option('--exact-max-steps', type="int", dest="exact_max_steps",
+                      help="Search steps of one exact match before it keeps the best mapping " \
+                           "found so far (Default: 100000)")
+    parser.set_defaults(r=4, v=False, ms=False, pr=False, bench=False, engine="python", seed=None,
+                        jobs=1, restart_jobs=1, restart_min_nodes=100, exact_max_nodes=0,
+                        exact_max_steps=100000, debug_match=False,
+                        stats=False, sentence_cache=False)
     return parser
 
 
 def get_best_match(instance1, attribute1, relation1,
                    instance2, attribute2, relation2,
-                   prefix1, prefix2):
+                   prefix1, prefix2, rng=None, iteration_count=None, engine_name=None,
+                   restart_jobs=None, exact_nodes=None, stats=None):
     """
     Get the highest triple match number between two sets of triples via hill-climbing.
     Arguments:
@@ -121,11 +225,26 @@ def get_best_match(instance1, attribute1, relation1,
         relation2: relation triples of AMR 2 (relation name, node 1 name, node 2 name)
         prefix1: prefix label for AMR 1
         prefix2: prefix label for AMR 2
+        rng: random.Random for the initial mappings (Default: the random module, freshly seeded)
+        iteration_count: number of hill-climbing runs (Default: iteration_num)
+        engine_name: hill-climbing implementation, one of ENGINES (Default: engine)
+        restart_jobs: number of worker processes for the hill-climbing runs of a pair with at
+            least restart_min_nodes nodes (Default: restart_job_num)
+        exact_nodes: after hill-climbing, search pairs of at most this many nodes exactly
+            (Default: exact_max_nodes)
+        stats: dictionary to add the numbers of hill-climbing runs done ("restarts") and skipped
+            because the best match already reached match_upper_bound ("skipped_restarts") to
     Returns:
         best_match: the node mapping that results in the highest triple matching number
         best_match_num: the highest triple matching number
 
     """
+    if iteration_count is None:
+        iteration_count = iteration_num
+    if engine_name is None:
+        engine_name = engine
+    if exact_nodes is None:
+        exact_nodes = exact_max_nodes
     # Compute candidate pool - all possible node match candidates.
     # In the hill-climbing, we only consider candidate in this pool to save computing time.
     # weight_dict is a dictionary that maps a pair of node
@@ -138,43 +257,360 @@ def get_best_match(instance1, attribute1, relation1,
         print(candidate_mappings, file=DEBUG_LOG)
         print("Weight dictionary", file=DEBUG_LOG)
         print(weight_dict, file=DEBUG_LOG)
+    initial_mappings = get_initial_mappings(candidate_mappings, instance1, instance2,
+                                            iteration_count, rng)
+    if restart_jobs is None:
+        restart_jobs = restart_job_num
+    # the runs are done lazily, so the ones after the best match reaches the bound are skipped
+    if restart_jobs > 1 and len(initial_mappings) > 1 and not verbose and \
+            max(len(instance1), len(instance2)) >= restart_min_nodes:
+        results = run_parallel_restarts(initial_mappings, candidate_mappings, weight_dict,
+                                        len(instance1), len(instance2), engine_name,
+                                        restart_jobs)
+    elif engine_name == "numpy":
+        arrays = WeightArrays(candidate_mappings, weight_dict, len(instance1), len(instance2))
+        results = (hill_climb_numpy(arrays, cur_mapping) for cur_mapping in initial_mappings)
+    else:
+        def climb_all():
+            for i, cur_mapping in enumerate(initial_mappings):
+                if verbose:
+                    print("Iteration", i, file=DEBUG_LOG)
+                yield hill_climb(cur_mapping, candidate_mappings, weight_dict, len(instance2))
+        results = climb_all()
+    match_bound = match_upper_bound(candidate_mappings, weight_dict,
+                                    len(instance1) + len(attribute1) + len(relation1),
+                                    len(instance2) + len(attribute2) + len(relation2))
     best_match_num = 0
     # initialize best match mapping
     # the ith entry is the node index in AMR 2 which maps to the ith node in AMR 1
     best_mapping = [-1] * len(instance1)
-    for i in range(0, iteration_num):
-        if verbose:
-            print("Iteration", i, file=DEBUG_LOG)
+    restart_num = 0
+    for (cur_mapping, match_num) in results:
+        if verbose and engine_name == "numpy":
+            print("Iteration", restart_num, "triple match number", match_num, file=DEBUG_LOG)
+        restart_num += 1
+        # the first of equally good restarts wins
+        if match_num > best_match_num:
+            best_mapping = cur_mapping[:]
+            best_match_num = match_num
+        if best_match_num >= match_bound:
+            # no other mapping can match more
+            break
+    results.close()
+    if max(len(instance1), len(instance2)) <= exact_nodes and best_match_num < match_bound:
+        # the hill-climbing result is the bound to beat, so a search stopped by exact_max_steps
+        # still returns a mapping at least as good
+        (best_mapping, best_match_num, exact) = exact_best_match(candidate_mappings, weight_dict,
+                                                                 len(instance1), best_mapping,
+                                                                 best_match_num)
+        if not exact:
+            print("Warning: exact match stopped after", exact_max_steps, "steps", file=ERROR_LOG)
+    if verbose:
+        print("Upper bound", match_bound, "of the match number; restarts skipped:",
+              len(initial_mappings) - restart_num, file=DEBUG_LOG)
+    if stats is not None:
+        stats["restarts"] = stats.get("restarts", 0) + restart_num
+        stats["skipped_restarts"] = stats.get("skipped_restarts", 0) + \
+            len(initial_mappings) - restart_num
+    return best_mapping, best_match_num
+
+
+def match_upper_bound(candidate_mappings, weight_dict, test_triple_num, gold_triple_num):
+    """
+    Cheap upper bound of the triple match number of any node mapping.
+    Each node of AMR 1 is given its best candidate, counting half of each relation weight
+    (the other half is counted at the relation's other node) at the best candidate of the other node.
+    No more triples can match than either AMR has.
+    Arguments:
+        candidate_mappings, weight_dict: candidate pool from compute_pool
+        test_triple_num: number of triples in AMR 1
+        gold_triple_num: number of triples in AMR 2
+    Returns:
+        the upper bound
+
+    """
+    # twice the bound, to keep the half weights integral
+    double_bound = 0
+    for i, candidates in enumerate(candidate_mappings):
+        best_value = 0
+        for m in candidates:
+            weights = weight_dict.get((i, m))
+            if weights is None:
+                continue
+            best_relation = {}
+            for key, weight in weights.items():
+                if key != -1 and key[0] != i and best_relation.get(key[0], 0) < weight:
+                    best_relation[key[0]] = weight
+            value = 2 * weights.get(-1, 0) + sum(best_relation.values())
+            if value > best_value:
+                best_value = value
+        double_bound += best_value
+    return min(double_bound // 2, test_triple_num, gold_triple_num)
+
+
+def get_initial_mappings(candidate_mappings, instance1, instance2, iteration_count, rng=None):
+    """
+    Draw the starting mappings of all hill-climbing runs, in run order:
+    smart initialization for the first run, random initialization for the others.
+    Returns:
+        list of iteration_count node mappings
+
+    """
+    initial_mappings = []
+    for i in range(0, iteration_count):
         if i == 0:
             # smart initialization used for the first round
-            cur_mapping = smart_init_mapping(candidate_mappings, instance1, instance2)
+            initial_mappings.append(smart_init_mapping(candidate_mappings, instance1, instance2, rng))
         else:
             # random initialization for the other round
-            cur_mapping = random_init_mapping(candidate_mappings)
-        # compute current triple match number
-        match_num = compute_match(cur_mapping, weight_dict)
+            initial_mappings.append(random_init_mapping(candidate_mappings, rng))
+    return initial_mappings
+
+
+def hill_climb(cur_mapping, candidate_mappings, weight_dict, instance_len):
+    """
+    Hill-climb from one node mapping until no swap/move improves the triple match number
+    Arguments:
+        cur_mapping: starting node mapping
+        candidate_mappings, weight_dict: candidate pool from compute_pool
+        instance_len: the number of the nodes in AMR 2
+    Returns:
+        the final node mapping and its triple match number
+
+    """
+    # compute current triple match number
+    match_num = compute_match(cur_mapping, weight_dict)
+    if verbose:
+        print("Node mapping at start", cur_mapping, file=DEBUG_LOG)
+        print("Triple match number at start:", match_num, file=DEBUG_LOG)
+    # the match number is kept up to date from here on, move by move
+    state = MatchState(cur_mapping, weight_dict, match_num)
+    if debug_match:
+        state.check()
+    while True:
+        # get best gain
+        (gain, node1, node2, use_swap) = state.best_step(candidate_mappings, instance_len)
         if verbose:
-            print("Node mapping at start", cur_mapping, file=DEBUG_LOG)
-            print("Triple match number at start:", match_num, file=DEBUG_LOG)
-        while True:
-            # get best gain
-            (gain, new_mapping) = get_best_gain(cur_mapping, candidate_mappings, weight_dict,
-                                                len(instance2), match_num)
-            if verbose:
-                print("Gain after the hill-climbing", gain, file=DEBUG_LOG)
-            # hill-climbing until there will be no gain for new node mapping
-            if gain <= 0:
-                break
-            # otherwise update match_num and mapping
-            match_num += gain
-            cur_mapping = new_mapping[:]
-            if verbose:
-                print("Update triple match number to:", match_num, file=DEBUG_LOG)
-                print("Current mapping:", cur_mapping, file=DEBUG_LOG)
-        if match_num > best_match_num:
-            best_mapping = cur_mapping[:]
-            best_match_num = match_num
-    return best_mapping, best_match_num
+            print("Gain after the hill-climbing", gain, file=DEBUG_LOG)
+        # hill-climbing until there will be no gain for new node mapping
+        if gain <= 0:
+            break
+        # otherwise update match_num and mapping
+        if use_swap:
+            state.swap(node1, node2)
+        else:
+            state.move(node1, node2)
+        if debug_match:
+            state.check()
+        if verbose:
+            print("Use", "swap" if use_swap else "move", "of", node1, node2, file=DEBUG_LOG)
+            print("Update triple match number to:", state.match_num, file=DEBUG_LOG)
+            print("Current mapping:", state.mapping, file=DEBUG_LOG)
+    return state.mapping, state.match_num
+
+
+def exact_best_match(candidate_mappings, weight_dict, instance_len1, best_mapping=None,
+                     best_match_num=0, max_steps=None):
+    """
+    Branch-and-bound search for the node mapping with the highest triple match number.
+    Nodes of AMR 1 are assigned in index order, each to one of its candidates or to nothing (-1).
+    A relation triple is credited to the later of its two nodes, so a node's gain depends only on
+    the nodes before it; the bound of the unassigned nodes takes, for each of them, its best
+    unused candidate, counting relations with other unassigned nodes at their highest weight.
+    It never underestimates, so the search only drops branches that cannot beat the best mapping.
+    Arguments:
+        candidate_mappings, weight_dict: candidate pool from compute_pool
+        instance_len1: the number of the nodes in AMR 1
+        best_mapping, best_match_num: a known mapping (e.g. from hill-climbing) to start from
+        max_steps: search nodes to visit at most (Default: exact_max_steps);
+            when they run out, the best mapping found so far is returned
+    Returns:
+        best_match: the node mapping that results in the highest triple matching number
+        best_match_num: the highest triple matching number
+        exact: False if the search was stopped by max_steps
+
+    """
+    if max_steps is None:
+        max_steps = exact_max_steps
+    if best_mapping is None:
+        best_mapping = [-1] * instance_len1
+    order = [i for i in range(instance_len1) if candidate_mappings[i]]
+    position = dict((i, d) for d, i in enumerate(order))
+    # options[d]: (AMR 2 node, instance/attribute weight, relations with earlier nodes) of node order[d]
+    options = []
+    # static bound of each node's gain, relations taken at the best option of the earlier node
+    node_bound = []
+    for d, i in enumerate(order):
+        node_options = []
+        best_gain = 0
+        for m in sorted(candidate_mappings[i]):
+            weights = weight_dict.get((i, m), {})
+            relations = []
+            best_relation = {}
+            for key, weight in weights.items():
+                if key == -1 or key[0] == i or position[key[0]] > d:
+                    continue
+                relations.append((key[0], key[1], weight))
+                best_relation[key[0]] = max(best_relation.get(key[0], 0), weight)
+            node_options.append((m, weights.get(-1, 0), relations))
+            best_gain = max(best_gain, weights.get(-1, 0) + sum(best_relation.values()))
+        options.append(node_options)
+        node_bound.append(best_gain)
+    suffix_bound = [0] * (len(order) + 1)
+    for d in range(len(order) - 1, -1, -1):
+        suffix_bound[d] = suffix_bound[d + 1] + node_bound[d]
+    mapping = [-1] * instance_len1
+    used = set()
+    best = [best_match_num, best_mapping[:]]
+    steps = [0]
+
+    def rest_bound(d):
+        # bound of the gains of the nodes after order[d], given the assignment of the nodes before it
+        bound = 0
+        for e in range(d + 1, len(order)):
+            best_gain = 0
+            for m, gain, relations in options[e]:
+                if m in used:
+                    continue
+                best_relation = {}
+                for k, b, weight in relations:
+                    if position[k] < d:
+                        if mapping[k] == b:
+                            gain += weight
+                    elif best_relation.get(k, 0) < weight:
+                        best_relation[k] = weight
+                gain += sum(best_relation.values())
+                if gain > best_gain:
+                    best_gain = gain
+            bound += best_gain
+        return min(bound, suffix_bound[d + 1])
+
+    def visit(d, match_num):
+        # count a search node; returns its options (gain, AMR 2 node) and the bound of the
+        # nodes after it, or None if nothing is to be searched below it
+        steps[0] += 1
+        if d == len(order):
+            if match_num > best[0]:
+                best[0] = match_num
+                best[1] = mapping[:]
+            return None
+        if steps[0] > max_steps:
+            return None
+        gains = []
+        for m, gain, relations in options[d]:
+            if m in used:
+                continue
+            for k, b, weight in relations:
+                if mapping[k] == b:
+                    gain += weight
+            gains.append((gain, m))
+        # try the best options first, leaving the node unmapped last
+        gains.sort(key=lambda x: -x[0])
+        gains.append((0, -1))
+        return gains, rest_bound(d)
+
+    def search():
+        # depth-first, with an explicit stack of [depth, match number, options, bound,
+        # next option] so that large AMRs do not run into the recursion limit
+        stack = []
+        frame = visit(0, 0)
+        if frame is not None:
+            stack.append([0, 0, frame[0], frame[1], 0])
+        while stack:
+            top = stack[-1]
+            d, match_num, gains, rest, k = top
+            i = order[d]
+            if k > 0 and gains[k - 1][1] != -1:
+                # undo the option tried last
+                used.discard(gains[k - 1][1])
+                mapping[i] = -1
+            while k < len(gains) and match_num + gains[k][0] + rest <= best[0]:
+                k += 1
+            if k == len(gains):
+                stack.pop()
+                continue
+            top[4] = k + 1
+            gain, m = gains[k]
+            mapping[i] = m
+            if m != -1:
+                used.add(m)
+            frame = visit(d + 1, match_num + gain)
+            if frame is not None:
+                stack.append([d + 1, match_num + gain, frame[0], frame[1], 0])
+
+    if suffix_bound[0] > best_match_num:
+        search()
+    if verbose:
+        print("Exact search steps:", steps[0], file=DEBUG_LOG)
+    return best[1], best[0], steps[0] <= max_steps
+
+
+def worker_settings():
+    """The current values of WORKER_SETTINGS, to hand to a worker process"""
+    return dict((name, globals()[name]) for name in WORKER_SETTINGS)
+
+
+def _init_pair_worker(settings):
+    """
+    Pool initializer of score_amr_pairs: take over the settings of the parent.
+    The workers never start pools of their own (daemonic processes cannot have children).
+
+    """
+    global restart_job_num
+    globals().update(settings)
+    restart_job_num = 1
+
+
+# state of a restart worker process, set once by _init_restart_worker
+_restart_state = None
+
+
+def _init_restart_worker(engine_name, candidate_mappings, weight_dict, instance_len1,
+                         instance_len2, settings):
+    """
+    Pool initializer of run_parallel_restarts: take over the settings of the parent and keep
+    the candidate pool of the current pair in the worker, so each task only carries its
+    initial mapping
+
+    """
+    global _restart_state
+    globals().update(settings)
+    if engine_name == "numpy":
+        _restart_state = (engine_name, WeightArrays(candidate_mappings, weight_dict,
+                                                    instance_len1, instance_len2))
+    else:
+        _restart_state = (engine_name, candidate_mappings, weight_dict, instance_len2)
+
+
+def _restart_task(cur_mapping):
+    """Worker entry point of run_parallel_restarts: one hill-climbing run"""
+    if _restart_state[0] == "numpy":
+        return hill_climb_numpy(_restart_state[1], cur_mapping)
+    (_, candidate_mappings, weight_dict, instance_len) = _restart_state
+    return hill_climb(cur_mapping, candidate_mappings, weight_dict, instance_len)
+
+
+def run_parallel_restarts(initial_mappings, candidate_mappings, weight_dict, instance_len1,
+                          instance_len2, engine_name, jobs):
+    """
+    Run the hill-climbing from each initial mapping in a pool of worker processes.
+    The candidate pool is handed to each worker once, through the pool initializer
+    (with fork, the workers read the parent's copy and nothing is pickled).
+    Returns:
+        generator of (node mapping, triple match number), in the order of initial_mappings;
+        closing it stops the runs not yet done
+
+    """
+    pool = multiprocessing.Pool(min(jobs, len(initial_mappings)), _init_restart_worker,
+                                (engine_name, candidate_mappings, weight_dict,
+                                 instance_len1, instance_len2, worker_settings()))
+    try:
+        for result in pool.imap(_restart_task, initial_mappings, 1):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def compute_pool(instance1, attribute1, relation1,
@@ -206,101 +642,111 @@ def compute_pool(instance1, attribute1, relation1,
     """
     candidate_mapping = []
     weight_dict = {}
+    # Group the triples of AMR 2 by their lowercased (label, value), or relation name, once.
+    # Each triple of AMR 1 is then joined with its bucket only. The buckets keep the order of
+    # AMR 2, so candidates and weights are added in the same order as a full pairwise scan.
+    instance2_buckets = {}
+    for j, triple in enumerate(instance2):
+        instance2_buckets.setdefault((triple[0].lower(), triple[2].lower()), []).append(j)
+    attribute2_buckets = {}
+    for j, triple in enumerate(attribute2):
+        attribute2_buckets.setdefault((triple[0].lower(), triple[2].lower()), []).append(j)
+    relation2_buckets = {}
+    for j, triple in enumerate(relation2):
+        relation2_buckets.setdefault(triple[0].lower(), []).append(j)
     for i in range(0, len(instance1)):
         # each candidate mapping is a set of node indices
         candidate_mapping.append(set())
-        for j in range(0, len(instance2)):
-            # if both triples are instance triples and have the same value
-            if instance1[i][0].lower() == instance2[j][0].lower() \
-                    and instance1[i][2].lower() == instance2[j][2].lower():
-                # get node index by stripping the prefix
-                node1_index = int(instance1[i][1][len(prefix1):])
-                node2_index = int(instance2[j][1][len(prefix2):])
-                candidate_mapping[node1_index].add(node2_index)
-                node_pair = (node1_index, node2_index)
-                # use -1 as key in weight_dict for instance triples and attribute triples
-                if node_pair in weight_dict:
-                    weight_dict[node_pair][-1] += 1
-                else:
-                    weight_dict[node_pair] = {}
-                    weight_dict[node_pair][-1] = 1
+        # triples with the same instance value
+        for j in instance2_buckets.get((instance1[i][0].lower(), instance1[i][2].lower()), ()):
+            # get node index by stripping the prefix
+            node1_index = int(instance1[i][1][len(prefix1):])
+            node2_index = int(instance2[j][1][len(prefix2):])
+            candidate_mapping[node1_index].add(node2_index)
+            node_pair = (node1_index, node2_index)
+            # use -1 as key in weight_dict for instance triples and attribute triples
+            if node_pair in weight_dict:
+                weight_dict[node_pair][-1] += 1
+            else:
+                weight_dict[node_pair] = {}
+                weight_dict[node_pair][-1] = 1
     for i in range(0, len(attribute1)):
-        for j in range(0, len(attribute2)):
-            # if both attribute relation triple have the same relation name and value
-            if attribute1[i][0].lower() == attribute2[j][0].lower() \
-                    and attribute1[i][2].lower() == attribute2[j][2].lower():
-                node1_index = int(attribute1[i][1][len(prefix1):])
-                node2_index = int(attribute2[j][1][len(prefix2):])
-                candidate_mapping[node1_index].add(node2_index)
-                node_pair = (node1_index, node2_index)
-                # use -1 as key in weight_dict for instance triples and attribute triples
-                if node_pair in weight_dict:
-                    weight_dict[node_pair][-1] += 1
-                else:
-                    weight_dict[node_pair] = {}
-                    weight_dict[node_pair][-1] = 1
+        # attribute triples with the same relation name and value
+        for j in attribute2_buckets.get((attribute1[i][0].lower(), attribute1[i][2].lower()), ()):
+            node1_index = int(attribute1[i][1][len(prefix1):])
+            node2_index = int(attribute2[j][1][len(prefix2):])
+            candidate_mapping[node1_index].add(node2_index)
+            node_pair = (node1_index, node2_index)
+            # use -1 as key in weight_dict for instance triples and attribute triples
+            if node_pair in weight_dict:
+                weight_dict[node_pair][-1] += 1
+            else:
+                weight_dict[node_pair] = {}
+                weight_dict[node_pair][-1] = 1
     for i in range(0, len(relation1)):
-        for j in range(0, len(relation2)):
-            # if both relation share the same name
-            if relation1[i][0].lower() == relation2[j][0].lower():
-                node1_index_amr1 = int(relation1[i][1][len(prefix1):])
-                node1_index_amr2 = int(relation2[j][1][len(prefix2):])
-                node2_index_amr1 = int(relation1[i][2][len(prefix1):])
-                node2_index_amr2 = int(relation2[j][2][len(prefix2):])
-                # add mapping between two nodes
-                candidate_mapping[node1_index_amr1].add(node1_index_amr2)
-                candidate_mapping[node2_index_amr1].add(node2_index_amr2)
-                node_pair1 = (node1_index_amr1, node1_index_amr2)
-                node_pair2 = (node2_index_amr1, node2_index_amr2)
-                if node_pair2 != node_pair1:
-                    # update weight_dict weight. Note that we need to update both entries for future search
-                    # i.e weight_dict[node_pair1][node_pair2]
-                    #     weight_dict[node_pair2][node_pair1]
-                    if node1_index_amr1 > node2_index_amr1:
-                        # swap node_pair1 and node_pair2
-                        node_pair1 = (node2_index_amr1, node2_index_amr2)
-                        node_pair2 = (node1_index_amr1, node1_index_amr2)
-                    if node_pair1 in weight_dict:
-                        if node_pair2 in weight_dict[node_pair1]:
-                            weight_dict[node_pair1][node_pair2] += 1
-                        else:
-                            weight_dict[node_pair1][node_pair2] = 1
+        # relation triples with the same name
+        for j in relation2_buckets.get(relation1[i][0].lower(), ()):
+            node1_index_amr1 = int(relation1[i][1][len(prefix1):])
+            node1_index_amr2 = int(relation2[j][1][len(prefix2):])
+            node2_index_amr1 = int(relation1[i][2][len(prefix1):])
+            node2_index_amr2 = int(relation2[j][2][len(prefix2):])
+            # add mapping between two nodes
+            candidate_mapping[node1_index_amr1].add(node1_index_amr2)
+            candidate_mapping[node2_index_amr1].add(node2_index_amr2)
+            node_pair1 = (node1_index_amr1, node1_index_amr2)
+            node_pair2 = (node2_index_amr1, node2_index_amr2)
+            if node_pair2 != node_pair1:
+                # update weight_dict weight. Note that we need to update both entries for future search
+                # i.e weight_dict[node_pair1][node_pair2]
+                #     weight_dict[node_pair2][node_pair1]
+                if node1_index_amr1 > node2_index_amr1:
+                    # swap node_pair1 and node_pair2
+                    node_pair1 = (node2_index_amr1, node2_index_amr2)
+                    node_pair2 = (node1_index_amr1, node1_index_amr2)
+                if node_pair1 in weight_dict:
+                    if node_pair2 in weight_dict[node_pair1]:
+                        weight_dict[node_pair1][node_pair2] += 1
                     else:
-                        weight_dict[node_pair1] = {}
-                        weight_dict[node_pair1][-1] = 0
                         weight_dict[node_pair1][node_pair2] = 1
-                    if node_pair2 in weight_dict:
-                        if node_pair1 in weight_dict[node_pair2]:
-                            weight_dict[node_pair2][node_pair1] += 1
-                        else:
-                            weight_dict[node_pair2][node_pair1] = 1
+                else:
+                    weight_dict[node_pair1] = {}
+                    weight_dict[node_pair1][-1] = 0
+                    weight_dict[node_pair1][node_pair2] = 1
+                if node_pair2 in weight_dict:
+                    if node_pair1 in weight_dict[node_pair2]:
+                        weight_dict[node_pair2][node_pair1] += 1
                     else:
-                        weight_dict[node_pair2] = {}
-                        weight_dict[node_pair2][-1] = 0
                         weight_dict[node_pair2][node_pair1] = 1
                 else:
-                    # two node pairs are the same. So we only update weight_dict once.
-                    # this generally should not happen.
-                    if node_pair1 in weight_dict:
-                        weight_dict[node_pair1][-1] += 1
-                    else:
-                        weight_dict[node_pair1] = {}
-                        weight_dict[node_pair1][-1] = 1
+                    weight_dict[node_pair2] = {}
+                    weight_dict[node_pair2][-1] = 0
+                    weight_dict[node_pair2][node_pair1] = 1
+            else:
+                # two node pairs are the same. So we only update weight_dict once.
+                # this generally should not happen.
+                if node_pair1 in weight_dict:
+                    weight_dict[node_pair1][-1] += 1
+                else:
+                    weight_dict[node_pair1] = {}
+                    weight_dict[node_pair1][-1] = 1
     return candidate_mapping, weight_dict
 
 
-def smart_init_mapping(candidate_mapping, instance1, instance2):
+def smart_init_mapping(candidate_mapping, instance1, instance2, rng=None):
     """
     Initialize mapping based on the concept mapping (smart initialization)
     Arguments:
         candidate_mapping: candidate node match list
         instance1: instance triples of AMR 1
         instance2: instance triples of AMR 2
+        rng: random.Random to draw from (Default: the random module, freshly seeded)
     Returns:
         initialized node mapping between two AMRs
 
     """
-    random.seed()
+    if rng is None:
+        random.seed()
+        rng = random
     matched_dict = {}
     result = []
     # list to store node indices that have no concept match
@@ -329,7 +775,7 @@ def smart_init_mapping(candidate_mapping, instance1, instance2):
         candidates = list(candidate_mapping[i])
         while len(candidates) > 0:
             # get a random node index from candidates
-            rid = random.randint(0, len(candidates) - 1)
+            rid = rng.randint(0, len(candidates) - 1)
             if candidates[rid] in matched_dict:
                 candidates.pop(rid)
             else:
@@ -339,17 +785,20 @@ def smart_init_mapping(candidate_mapping, instance1, instance2):
     return result
 
 
-def random_init_mapping(candidate_mapping):
+def random_init_mapping(candidate_mapping, rng=None):
     """
     Generate a random node mapping.
     Args:
         candidate_mapping: candidate_mapping: candidate node match list
+        rng: random.Random to draw from (Default: the random module, freshly seeded)
     Returns:
         randomly-generated node mapping between two AMRs
 
     """
-    # if needed, a fixed seed could be passed here to generate same random (to help debugging)
-    random.seed()
+    # a seeded rng gives the same mapping every time (to help debugging)
+    if rng is None:
+        random.seed()
+        rng = random
     matched_dict = {}
     result = []
     for c in candidate_mapping:
@@ -361,7 +810,7 @@ def random_init_mapping(candidate_mapping):
         found = False
         while len(candidates) > 0:
             # randomly generate an index in [0, length of candidates)
-            rid = random.randint(0, len(candidates) - 1)
+            rid = rng.randint(0, len(candidates) - 1)
             # check if it has already been matched
             if candidates[rid] in matched_dict:
                 candidates.pop(rid)
@@ -383,16 +832,13 @@ def compute_match(mapping, weight_dict):
     Returns:
     matching triple number
     Complexity: O(m*n) , m is the node number of AMR 1, n is the node number of AMR 2
+    The result is not memoized: hill climbing only calls this once per restart, on the starting
+    mapping, and MatchState computes every gain after that from the node pairs involved.
 
     """
-    # If this mapping has been investigated before, retrieve the value instead of re-computing.
     if verbose:
         print("Computing match for mapping", file=DEBUG_LOG)
         print(mapping, file=DEBUG_LOG)
-    if tuple(mapping) in match_triple_dict:
-        if verbose:
-            print("saved value", match_triple_dict[tuple(mapping)], file=DEBUG_LOG)
-        return match_triple_dict[tuple(mapping)]
     match_num = 0
     # i is node index in AMR 1, m is node index in AMR 2
     for i, m in enumerate(mapping):
@@ -422,221 +868,287 @@ def compute_match(mapping, weight_dict):
                     print("relation match with", key, weight_dict[current_node_pair][key], file=DEBUG_LOG)
     if verbose:
         print("match computing complete, result:", match_num, file=DEBUG_LOG)
-    # update match_triple_dict
-    match_triple_dict[tuple(mapping)] = match_num
     return match_num
 
 
-def move_gain(mapping, node_id, old_id, new_id, weight_dict, match_num):
+class MatchState(object):
     """
-    Compute the triple match number gain from the move operation
-    Arguments:
-        mapping: current node mapping
-        node_id: remapped node in AMR 1
-        old_id: original node id in AMR 2 to which node_id is mapped
-        new_id: new node in to which node_id is mapped
-        weight_dict: weight dictionary
-        match_num: the original triple matching number
-    Returns:
-        the triple match gain number (might be negative)
-
-    """
-    # new node mapping after moving
-    new_mapping = (node_id, new_id)
-    # node mapping before moving
-    old_mapping = (node_id, old_id)
-    # new nodes mapping list (all node pairs)
-    new_mapping_list = mapping[:]
-    new_mapping_list[node_id] = new_id
-    # if this mapping is already been investigated, use saved one to avoid duplicate computing
-    if tuple(new_mapping_list) in match_triple_dict:
-        return match_triple_dict[tuple(new_mapping_list)] - match_num
-    gain = 0
-    # add the triple match incurred by new_mapping to gain
-    if new_mapping in weight_dict:
-        for key in weight_dict[new_mapping]:
-            if key == -1:
-                # instance/attribute triple match
-                gain += weight_dict[new_mapping][-1]
-            elif new_mapping_list[key[0]] == key[1]:
-                # relation gain incurred by new_mapping and another node pair in new_mapping_list
-                gain += weight_dict[new_mapping][key]
-    # deduct the triple match incurred by old_mapping from gain
-    if old_mapping in weight_dict:
-        for k in weight_dict[old_mapping]:
-            if k == -1:
-                gain -= weight_dict[old_mapping][-1]
-            elif mapping[k[0]] == k[1]:
-                gain -= weight_dict[old_mapping][k]
-    # update match number dictionary
-    match_triple_dict[tuple(new_mapping_list)] = match_num + gain
-    return gain
-
-
-def swap_gain(mapping, node_id1, mapping_id1, node_id2, mapping_id2, weight_dict, match_num):
-    """
-    Compute the triple match number gain from the swapping
+    A node mapping and its triple match number, kept up to date as nodes are moved and swapped.
+    Every gain, and every update, only looks at the weight_dict entries of the node pairs involved,
+    i.e. it costs O(degree) instead of the O(m*n) of compute_match.
+    Members:
+        mapping: the current node mapping
+        match_num: its triple match number
+        contribution: contribution[i] is the match of the node pair (i, mapping[i]): its
+            instance/attribute triples, plus its relation triples with the other nodes' pairs
+            (each relation is in the contribution of both its nodes, and in match_num once)
+
+    """
+    def __init__(self, mapping, weight_dict, match_num):
+        self.weight_dict = weight_dict
+        self.mapping = mapping[:]
+        self.match_num = match_num
+        # (instance/attribute weight, [(node in AMR 1, node in AMR 2, relation weight), ...]) of a node pair
+        self.pair_weights = {}
+        for node_pair, weights in weight_dict.items():
+            relations = [(key[0], key[1], weight) for key, weight in weights.items()
+                         if key != -1 and key[0] != node_pair[0]]
+            self.pair_weights[node_pair] = (weights.get(-1, 0), relations)
+        self.contribution = [self.pair_match(i, m) for i, m in enumerate(self.mapping)]
+
+    def pair_match(self, node_id, mapping_id, skip_id=None):
+        """
+        Match of the node pair (node_id, mapping_id) under the current mapping of the other nodes,
+        leaving out the relations with skip_id
+
+        """
+        if (node_id, mapping_id) not in self.pair_weights:
+            return 0
+        (match_num, relations) = self.pair_weights[(node_id, mapping_id)]
+        mapping = self.mapping
+        for k, b, weight in relations:
+            if mapping[k] == b and k != skip_id:
+                match_num += weight
+        return match_num
+
+    def relation_weight(self, node_pair1, node_pair2):
+        return self.weight_dict.get(node_pair1, {}).get(node_pair2, 0)
+
+    def move_gain(self, node_id, new_id):
+        """Gain of remapping node_id to new_id, a node of AMR 2 no other node maps to"""
+        return self.pair_match(node_id, new_id) - self.contribution[node_id]
+
+    def swap_gain(self, node_id1, node_id2):
+        """Gain of swapping the nodes of AMR 2 that node_id1 and node_id2 map to"""
+        mapping_id1 = self.mapping[node_id1]
+        mapping_id2 = self.mapping[node_id2]
+        new_relation = self.relation_weight((node_id1, mapping_id2), (node_id2, mapping_id1))
+        old_relation = self.relation_weight((node_id1, mapping_id1), (node_id2, mapping_id2))
+        # the relation between the two nodes is in both contributions, so count it once
+        return self.pair_match(node_id1, mapping_id2, node_id2) + \
+            self.pair_match(node_id2, mapping_id1, node_id1) + new_relation - \
+            self.contribution[node_id1] - self.contribution[node_id2] + old_relation
+
+    def move(self, node_id, new_id):
+        """Remap node_id to new_id and update the match number and the contributions"""
+        gain = self.move_gain(node_id, new_id)
+        mapping = self.mapping
+        contribution = self.contribution
+        old_pair = (node_id, mapping[node_id])
+        if old_pair in self.pair_weights:
+            for k, b, weight in self.pair_weights[old_pair][1]:
+                if mapping[k] == b:
+                    contribution[k] -= weight
+        if (node_id, new_id) in self.pair_weights:
+            for k, b, weight in self.pair_weights[(node_id, new_id)][1]:
+                if mapping[k] == b:
+                    contribution[k] += weight
+        mapping[node_id] = new_id
+        contribution[node_id] += gain
+        self.match_num += gain
+
+    def swap(self, node_id1, node_id2):
+        """Swap the nodes of AMR 2 that node_id1 and node_id2 map to"""
+        gain = self.swap_gain(node_id1, node_id2)
+        match_num = self.match_num
+        mapping_id1 = self.mapping[node_id1]
+        self.move(node_id1, self.mapping[node_id2])
+        self.move(node_id2, mapping_id1)
+        self.match_num = match_num + gain
+
+    def best_step(self, candidate_mappings, instance_len):
+        """
+        Find the move or swap with the largest gain: the first move (by node of AMR 1, then node of
+        AMR 2) with the largest gain, unless a swap (by first, then second node) has a strictly larger gain
+        Returns:
+            largest_gain: its gain (0 if no step improves the match)
+            node1, node2: the nodes of AMR 1 to swap, or the node of AMR 1 and the node of AMR 2 to move it to
+            use_swap: True for a swap, False for a move
+
+        """
+        mapping = self.mapping
+        largest_gain = 0
+        use_swap = True
+        node1 = None
+        node2 = None
+        # unmatched nodes in AMR 2
+        unmatched = set(range(0, instance_len))
+        for nid in mapping:
+            if nid in unmatched:
+                unmatched.remove(nid)
+        for i in range(len(mapping)):
+            for nm in unmatched:
+                if nm in candidate_mappings[i]:
+                    mv_gain = self.move_gain(i, nm)
+                    if mv_gain > largest_gain:
+                        largest_gain = mv_gain
+                        node1 = i
+                        node2 = nm
+                        use_swap = False
+        for i in range(len(mapping)):
+            for j in range(i + 1, len(mapping)):
+                sw_gain = self.swap_gain(i, j)
+                if sw_gain > largest_gain:
+                    largest_gain = sw_gain
+                    node1 = i
+                    node2 = j
+                    use_swap = True
+        return largest_gain, node1, node2, use_swap
+
+    def check(self):
+        """Debug assertion: the kept match number and contributions agree with a full recomputation"""
+        match_num = compute_match(self.mapping, self.weight_dict)
+        if match_num != self.match_num:
+            raise AssertionError("Inconsistency in computing: match number %d, recomputed %d, mapping %s" %
+                                 (self.match_num, match_num, self.mapping))
+        for i, m in enumerate(self.mapping):
+            if self.contribution[i] != self.pair_match(i, m):
+                raise AssertionError("Inconsistency in computing: contribution of node %d" % i)
+
+
+class WeightArrays(object):
+    """
+    The candidate pool (candidate_mapping, weight_dict) as NumPy arrays, for the numpy engine.
+    Nodes of AMR 2 are columns; column n2 stands for "not mapped" (-1) and has no weight.
+    Members:
+        node_weight: (n1, n2 + 1) instance/attribute triple match of each node pair (weight_dict key -1)
+        candidate: (n1, n2 + 1) True where node j of AMR 2 is in candidate_mapping[i]
+        rel_row, rel_col, rel_other, rel_other_col, rel_weight: relation entries, one per
+            weight_dict[(i, a)][(k, b)] with k != i: node pair (i, a) gains rel_weight if k maps to b
+        rel_keys: sorted codes of the relation entries, for looking up the weight of two node pairs
+        rel_key_weight: relation weight of each code in rel_keys
+
+    """
+    def __init__(self, candidate_mapping, weight_dict, n1, n2):
+        self.n1 = n1
+        self.n2 = n2
+        width = n2 + 1
+        self.node_weight = np.zeros((n1, width), dtype=np.int64)
+        self.candidate = np.zeros((n1, width), dtype=bool)
+        for i, candidates in enumerate(candidate_mapping):
+            for j in candidates:
+                self.candidate[i, j] = True
+        entries = []
+        for (i, a), weights in weight_dict.items():
+            for key, weight in weights.items():
+                if key == -1:
+                    self.node_weight[i, a] = weight
+                elif key[0] != i:
+                    # a pair with the same node of AMR 1 can never hold together with (i, a)
+                    entries.append((i, a, key[0], key[1], weight))
+        entries = np.array(entries, dtype=np.int64).reshape(-1, 5)
+        self.rel_row, self.rel_col, self.rel_other, self.rel_other_col, self.rel_weight = entries.T
+        codes = self.pair_code(self.rel_row, self.rel_col, self.rel_other, self.rel_other_col)
+        order = np.argsort(codes)
+        self.rel_keys = codes[order]
+        self.rel_key_weight = self.rel_weight[order]
+
+    def pair_code(self, i, a, k, b):
+        width = self.n2 + 1
+        return ((i * width + a) * self.n1 + k) * width + b
+
+    def pair_weight(self, i, a, k, b):
+        """relation weight between node pairs (i, a) and (k, b), elementwise over arrays"""
+        codes = self.pair_code(i, a, k, b)
+        if len(self.rel_keys) == 0:
+            return np.zeros(codes.shape, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.rel_keys, codes), len(self.rel_keys) - 1)
+        return np.where(self.rel_keys[pos] == codes, self.rel_key_weight[pos], 0)
+
+    def pair_totals(self, mapping):
+        """
+        (n1, n2 + 1) triple match of every node pair (i, j) given that the other nodes of
+        AMR 1 keep their current mapping (mapping uses column n2 for "not mapped")
+        """
+        width = self.n2 + 1
+        holds = mapping[self.rel_other] == self.rel_other_col
+        relation = np.bincount(self.rel_row * width + self.rel_col,
+                               weights=self.rel_weight * holds, minlength=self.n1 * width)
+        return self.node_weight + relation.reshape(self.n1, width).astype(np.int64)
+
+    def match_num(self, mapping):
+        """triple match number of a mapping, as compute_match"""
+        rows = np.arange(self.n1)
+        totals = self.pair_totals(mapping)
+        # every relation match is counted once from each side
+        relation = totals[rows, mapping] - self.node_weight[rows, mapping]
+        return int(self.node_weight[rows, mapping].sum() + relation.sum() // 2)
+
+
+def get_best_gain_numpy(arrays, mapping):
+    """
+    Vectorized MatchState.best_step: score every move and every swap of one hill-climbing step at
+    once, breaking ties the same way.
     Arguments:
-    mapping: current node mapping list
-    node_id1: node 1 index in AMR 1
-    mapping_id1: the node index in AMR 2 node 1 maps to (in the current mapping)
-    node_id2: node 2 index in AMR 1
-    mapping_id2: the node index in AMR 2 node 2 maps to (in the current mapping)
-    weight_dict: weight dictionary
-    match_num: the original matching triple number
+        arrays: WeightArrays of the candidate pool
+        mapping: current node mapping (array, column n2 for "not mapped")
     Returns:
-    the gain number (might be negative)
-
-    """
-    new_mapping_list = mapping[:]
-    # Before swapping, node_id1 maps to mapping_id1, and node_id2 maps to mapping_id2
-    # After swapping, node_id1 maps to mapping_id2 and node_id2 maps to mapping_id1
-    new_mapping_list[node_id1] = mapping_id2
-    new_mapping_list[node_id2] = mapping_id1
-    if tuple(new_mapping_list) in match_triple_dict:
-        return match_triple_dict[tuple(new_mapping_list)] - match_num
-    gain = 0
-    new_mapping1 = (node_id1, mapping_id2)
-    new_mapping2 = (node_id2, mapping_id1)
-    old_mapping1 = (node_id1, mapping_id1)
-    old_mapping2 = (node_id2, mapping_id2)
-    if node_id1 > node_id2:
-        new_mapping2 = (node_id1, mapping_id2)
-        new_mapping1 = (node_id2, mapping_id1)
-        old_mapping1 = (node_id2, mapping_id2)
-        old_mapping2 = (node_id1, mapping_id1)
-    if new_mapping1 in weight_dict:
-        for key in weight_dict[new_mapping1]:
-            if key == -1:
-                gain += weight_dict[new_mapping1][-1]
-            elif new_mapping_list[key[0]] == key[1]:
-                gain += weight_dict[new_mapping1][key]
-    if new_mapping2 in weight_dict:
-        for key in weight_dict[new_mapping2]:
-            if key == -1:
-                gain += weight_dict[new_mapping2][-1]
-            # to avoid duplicate
-            elif key[0] == node_id1:
-                continue
-            elif new_mapping_list[key[0]] == key[1]:
-                gain += weight_dict[new_mapping2][key]
-    if old_mapping1 in weight_dict:
-        for key in weight_dict[old_mapping1]:
-            if key == -1:
-                gain -= weight_dict[old_mapping1][-1]
-            elif mapping[key[0]] == key[1]:
-                gain -= weight_dict[old_mapping1][key]
-    if old_mapping2 in weight_dict:
-        for key in weight_dict[old_mapping2]:
-            if key == -1:
-                gain -= weight_dict[old_mapping2][-1]
-            # to avoid duplicate
-            elif key[0] == node_id1:
-                continue
-            elif mapping[key[0]] == key[1]:
-                gain -= weight_dict[old_mapping2][key]
-    match_triple_dict[tuple(new_mapping_list)] = match_num + gain
-    return gain
+        the largest gain, and the mapping after the move/swap (a copy; the input if no gain)
 
+    """
+    n1, n2 = arrays.n1, arrays.n2
+    rows = np.arange(n1)
+    totals = arrays.pair_totals(mapping)
+    current = totals[rows, mapping]
+    # moves: remap node i to an unmatched candidate node
+    unmatched = np.ones(n2 + 1, dtype=bool)
+    unmatched[mapping] = False
+    move_gain = totals - current[:, None]
+    move_ok = arrays.candidate & unmatched[None, :]
+    best_move = -1
+    largest_gain = 0
+    if move_ok.any():
+        move_gain = np.where(move_ok, move_gain, np.iinfo(np.int64).min)
+        k = int(np.argmax(move_gain))
+        if move_gain.flat[k] > largest_gain:
+            best_move = k
+            largest_gain = int(move_gain.flat[k])
+    # swaps: exchange the nodes that i and j (i < j) map to
+    best_swap = -1
+    if n1 > 1:
+        i, j = np.triu_indices(n1, 1)
+        mi = mapping[i]
+        mj = mapping[j]
+        swap_gain = (totals[i, mj] + totals[j, mi] - current[i] - current[j]
+                     # the pair terms above were computed with i and j at their old nodes
+                     - arrays.pair_weight(i, mj, j, mj) - arrays.pair_weight(j, mi, i, mi)
+                     + arrays.pair_weight(i, mj, j, mi) + arrays.pair_weight(i, mi, j, mj))
+        k = int(np.argmax(swap_gain))
+        if swap_gain[k] > largest_gain:
+            largest_gain = int(swap_gain[k])
+            best_swap = k
+    new_mapping = mapping
+    if best_swap >= 0:
+        new_mapping = mapping.copy()
+        new_mapping[i[best_swap]], new_mapping[j[best_swap]] = mj[best_swap], mi[best_swap]
+    elif best_move >= 0:
+        new_mapping = mapping.copy()
+        node1, node2 = divmod(best_move, n2 + 1)
+        new_mapping[node1] = node2
+    return largest_gain, new_mapping
 
-def get_best_gain(mapping, candidate_mappings, weight_dict, instance_len, cur_match_num):
+
+def hill_climb_numpy(arrays, cur_mapping):
     """
-    Hill-climbing method to return the best gain swap/move can get
+    hill_climb with the candidate pool held in NumPy arrays (used when engine is "numpy").
+    For the same starting mapping the result is the same.
     Arguments:
-    mapping: current node mapping
-    candidate_mappings: the candidates mapping list
-    weight_dict: the weight dictionary
-    instance_len: the number of the nodes in AMR 2
-    cur_match_num: current triple match number
+        arrays: WeightArrays of the candidate pool
+        cur_mapping: starting node mapping
     Returns:
-    the best gain we can get via swap/move operation
+        the final node mapping and its triple match number
 
     """
-    largest_gain = 0
-    # True: using swap; False: using move
-    use_swap = True
-    # the node to be moved/swapped
-    node1 = None
-    # store the other node affected. In swap, this other node is the node swapping with node1. In move, this other
-    # node is the node node1 will move to.
-    node2 = None
-    # unmatched nodes in AMR 2
-    unmatched = set(range(0, instance_len))
-    # exclude nodes in current mapping
-    # get unmatched nodes
-    for nid in mapping:
-        if nid in unmatched:
-            unmatched.remove(nid)
-    for i, nid in enumerate(mapping):
-        # current node i in AMR 1 maps to node nid in AMR 2
-        for nm in unmatched:
-            if nm in candidate_mappings[i]:
-                # remap i to another unmatched node (move)
-                # (i, m) -> (i, nm)
-                if verbose:
-                    print("Remap node", i, "from ", nid, "to", nm, file=DEBUG_LOG)
-                mv_gain = move_gain(mapping, i, nid, nm, weight_dict, cur_match_num)
-                if verbose:
-                    print("Move gain:", mv_gain, file=DEBUG_LOG)
-                    new_mapping = mapping[:]
-                    new_mapping[i] = nm
-                    new_match_num = compute_match(new_mapping, weight_dict)
-                    if new_match_num != cur_match_num + mv_gain:
-                        print(mapping, new_mapping, file=ERROR_LOG)
-                        print("Inconsistency in computing: move gain", cur_match_num, mv_gain, \
-                            new_match_num, file=ERROR_LOG)
-                if mv_gain > largest_gain:
-                    largest_gain = mv_gain
-                    node1 = i
-                    node2 = nm
-                    use_swap = False
-    # compute swap gain
-    for i, m in enumerate(mapping):
-        for j in range(i+1, len(mapping)):
-            m2 = mapping[j]
-            # swap operation (i, m) (j, m2) -> (i, m2) (j, m)
-            # j starts from i+1, to avoid duplicate swap
-            if verbose:
-                print("Swap node", i, "and", j, file=DEBUG_LOG)
-                print("Before swapping:", i, "-", m, ",", j, "-", m2, file=DEBUG_LOG)
-                print(mapping, file=DEBUG_LOG)
-                print("After swapping:", i, "-", m2, ",", j, "-", m, file=DEBUG_LOG)
-            sw_gain = swap_gain(mapping, i, m, j, m2, weight_dict, cur_match_num)
-            if verbose:
-                print("Swap gain:", sw_gain, file=DEBUG_LOG)
-                new_mapping = mapping[:]
-                new_mapping[i] = m2
-                new_mapping[j] = m
-                print(new_mapping, file=DEBUG_LOG)
-                new_match_num = compute_match(new_mapping, weight_dict)
-                if new_match_num != cur_match_num + sw_gain:
-                    print(match, new_match, file=ERROR_LOG)
-                    print("Inconsistency in computing: swap gain", cur_match_num, sw_gain, new_match_num, file=ERROR_LOG)
-            if sw_gain > largest_gain:
-                largest_gain = sw_gain
-                node1 = i
-                node2 = j
-                use_swap = True
-    # generate a new mapping based on swap/move
-    cur_mapping = mapping[:]
-    if node1 is not None:
-        if use_swap:
-            if verbose:
-                print("Use swap gain", file=DEBUG_LOG)
-            temp = cur_mapping[node1]
-            cur_mapping[node1] = cur_mapping[node2]
-            cur_mapping[node2] = temp
-        else:
-            if verbose:
-                print("Use move gain", file=DEBUG_LOG)
-            cur_mapping[node1] = node2
-    else:
-        if verbose:
-            print("no move/swap gain found", file=DEBUG_LOG)
-    if verbose:
-        print("Original mapping", mapping, file=DEBUG_LOG)
-        print("Current mapping", cur_mapping, file=DEBUG_LOG)
-    return largest_gain, cur_mapping
+    n1, n2 = arrays.n1, arrays.n2
+    mapping = np.array(cur_mapping, dtype=np.int64).reshape(n1)
+    mapping[mapping == -1] = n2
+    match_num = arrays.match_num(mapping)
+    while True:
+        (gain, mapping) = get_best_gain_numpy(arrays, mapping)
+        if gain <= 0:
+            break
+        match_num += gain
+    return [int(m) if m != n2 else -1 for m in mapping], match_num
 
 
 def print_alignment(mapping, instance1, instance2):
@@ -689,6 +1201,347 @@ def compute_f(match_num, test_num, gold_num):
         return precision, recall, 0.00
 
 
+def read_triple_pairs(file1, file2, prefix1="a", prefix2="b"):
+    """
+    Read all AMR pairs of two open files and get their triples
+    Returns:
+        list of (instance1, attribute1, relation1, instance2, attribute2, relation2), one per pair
+
+    """
+    triple_pairs = []
+    while True:
+        cur_amr1 = get_amr_line(file1)
+        cur_amr2 = get_amr_line(file2)
+        if cur_amr1 == "" or cur_amr2 == "":
+            break
+        triple_pairs.append(amr_triples(cur_amr1, prefix1) + amr_triples(cur_amr2, prefix2))
+    return triple_pairs
+
+
+def benchmark_pool(file1, file2, repeat=3):
+    """
+    Time compute_pool over all AMR pairs of two open files
+    Returns:
+        number of pairs, best total time in seconds over repeat runs
+
+    """
+    triple_pairs = read_triple_pairs(file1, file2)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for triples in triple_pairs:
+            compute_pool(*(triples + ("a", "b")))
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(triple_pairs), best
+
+
+def iter_amr_pairs(file1, file2):
+    """
+    Yield the (one-line) AMR pairs of two open files, in order.
+    Stops with an error message if one file has fewer AMRs than the other.
+
+    """
+    while True:
+        cur_amr1 = get_amr_line(file1)
+        cur_amr2 = get_amr_line(file2)
+        if cur_amr1 == "" and cur_amr2 == "":
+            break
+        if cur_amr1 == "":
+            print("Error: File 1 has less AMRs than file 2", file=ERROR_LOG)
+            print("Ignoring remaining AMRs", file=ERROR_LOG)
+            break
+        if cur_amr2 == "":
+            print("Error: File 2 has less AMRs than file 1", file=ERROR_LOG)
+            print("Ignoring remaining AMRs", file=ERROR_LOG)
+            break
+        yield cur_amr1, cur_amr2
+
+
+def amr_triples(cur_amr, prefix):
+    """
+    Parse an AMR in one-line form, rename its nodes to prefix + index and get its triples
+    Returns:
+        (instance triples, attribute triples, relation triples)
+
+    """
+    amr_graph = amr.AMR.parse_AMR_line_fast(cur_amr)
+    amr_graph.rename_node(prefix)
+    return amr_graph.get_triples()
+
+
+def score_amr_pair(cur_amr1, cur_amr2, sent_num=1, iteration_count=None, engine_name=None,
+                   seed=None, exact_nodes=None, stats=None, triples2=None):
+    """
+    Compute the best triple match between two AMRs.
+    All state of the search (the random generator) is local to the call,
+    so pairs can be scored in any order, or in different processes.
+    Arguments:
+        cur_amr1, cur_amr2: the two AMRs in one-line form
+        sent_num: position of the pair in the input, used with seed
+        iteration_count: number of hill-climbing runs (Default: iteration_num)
+        engine_name: hill-climbing implementation, one of ENGINES (Default: engine)
+        seed: random seed; the pair's generator is seeded from (seed, sent_num) (Default: none)
+        exact_nodes: match pairs of at most this many nodes exactly (Default: exact_max_nodes)
+        stats: dictionary to add hill-climbing statistics to (see get_best_match)
+        triples2: the triples of AMR 2 from amr_triples(cur_amr2, "b"), if already known;
+            cur_amr2 is then not parsed (and may be None)
+    Returns:
+        best_match_num: the highest triple matching number
+        test_triple_num: number of triples in AMR 1
+        gold_triple_num: number of triples in AMR 2
+
+    """
+    prefix1 = "a"
+    prefix2 = "b"
+    # Rename node to "a1", "a2", .etc
+    (instance1, attributes1, relation1) = amr_triples(cur_amr1, prefix1)
+    # Renaming node to "b1", "b2", .etc
+    if triples2 is None:
+        triples2 = amr_triples(cur_amr2, prefix2)
+    (instance2, attributes2, relation2) = triples2
+    if verbose:
+        # print parse results of two AMRs
+        print("AMR pair", sent_num, file=DEBUG_LOG)
+        print("============================================", file=DEBUG_LOG)
+        print("AMR 1 (one-line):", cur_amr1, file=DEBUG_LOG)
+        if cur_amr2 is not None:
+            print("AMR 2 (one-line):", cur_amr2, file=DEBUG_LOG)
+        print("Instance triples of AMR 1:", len(instance1), file=DEBUG_LOG)
+        print(instance1, file=DEBUG_LOG)
+        print("Attribute triples of AMR 1:", len(attributes1), file=DEBUG_LOG)
+        print(attributes1, file=DEBUG_LOG)
+        print("Relation triples of AMR 1:", len(relation1), file=DEBUG_LOG)
+        print(relation1, file=DEBUG_LOG)
+        print("Instance triples of AMR 2:", len(instance2), file=DEBUG_LOG)
+        print(instance2, file=DEBUG_LOG)
+        print("Attribute triples of AMR 2:", len(attributes2), file=DEBUG_LOG)
+        print(attributes2, file=DEBUG_LOG)
+        print("Relation triples of AMR 2:", len(relation2), file=DEBUG_LOG)
+        print(relation2, file=DEBUG_LOG)
+    # each pair gets its own generator, so its score does not depend on the pairs before it
+    rng = None
+    if seed is not None:
+        rng = random.Random("%d-%d" % (seed, sent_num))
+    (best_mapping, best_match_num) = get_best_match(instance1, attributes1, relation1,
+                                                    instance2, attributes2, relation2,
+                                                    prefix1, prefix2, rng,
+                                                    iteration_count, engine_name, None,
+                                                    exact_nodes=exact_nodes, stats=stats)
+    if verbose:
+        print("best match number", best_match_num, file=DEBUG_LOG)
+        print("best node mapping", best_mapping, file=DEBUG_LOG)
+        print("Best node mapping alignment:", print_alignment(best_mapping, instance1, instance2), file=DEBUG_LOG)
+    test_triple_num = len(instance1) + len(attributes1) + len(relation1)
+    gold_triple_num = len(instance2) + len(attributes2) + len(relation2)
+    return best_match_num, test_triple_num, gold_triple_num
+
+
+def _score_pair_task(task):
+    """
+    Worker entry point for score_amr_pairs: task is (sent_num, cur_amr1, cur_amr2, triples2,
+    iteration_count, engine_name, seed, exact_nodes); returns the score of the pair
+    and its hill-climbing statistics
+
+    """
+    (sent_num, cur_amr1, cur_amr2, triples2, iteration_count, engine_name, seed, exact_nodes) = task
+    stats = {}
+    result = score_amr_pair(cur_amr1, cur_amr2, sent_num, iteration_count, engine_name, seed,
+                            exact_nodes, stats, triples2)
+    return result, stats
+
+
+def score_amr_pairs(amr_pairs, jobs=1, iteration_count=None, engine_name=None, seed=None,
+                    exact_nodes=None, chunksize=8, stats=None):
+    """
+    Score a sequence of AMR pairs, serially or with a pool of worker processes.
+    Results are yielded in input order either way, and with a fixed seed they do not depend on jobs.
+    Arguments:
+        amr_pairs: iterable of (cur_amr1, cur_amr2) one-line AMR pairs, numbered from 1;
+            or of (cur_amr1, cur_amr2, sent_num, triples2), to give the number of each pair
+            and the triples of AMR 2 (see score_amr_pair)
+        jobs: number of worker processes (Default: 1, no pool)
+        iteration_count, engine_name, seed, exact_nodes: see score_amr_pair
+        chunksize: number of pairs sent to a worker at a time
+        stats: dictionary to add hill-climbing statistics of all pairs to (see get_best_match)
+    Returns:
+        generator of (best_match_num, test_triple_num, gold_triple_num), one per pair
+
+    """
+    if iteration_count is None:
+        iteration_count = iteration_num
+    if engine_name is None:
+        engine_name = engine
+    if exact_nodes is None:
+        exact_nodes = exact_max_nodes
+    tasks = (((pair[2], pair[0], pair[1], pair[3]) if len(pair) == 4 else
+              (sent_num, pair[0], pair[1], None)) +
+             (iteration_count, engine_name, seed, exact_nodes)
+             for sent_num, pair in enumerate(amr_pairs, 1))
+    pool = None
+    if jobs <= 1:
+        results = (_score_pair_task(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(jobs, _init_pair_worker, (worker_settings(),))
+        results = pool.imap(_score_pair_task, tasks, chunksize)
+    try:
+        for (result, pair_stats) in results:
+            if stats is not None:
+                for key, value in pair_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+            yield result
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+class SentenceCache(object):
+    """
+    Sidecar cache of a gold AMR file, kept next to it (gold file + SENTENCE_CACHE_SUFFIX):
+    the triples of every gold AMR, renamed with prefix "b", and the scores of the test AMRs
+    already compared with it. When another system output is scored against the same gold file,
+    only the sentences whose test AMR was not scored before are matched again.
+    The cache is dropped when the size or modification time of the gold file changes.
+    It is kept in marshal format, so loading it never runs code.
+    Members:
+        gold_triples: (instance, attribute, relation) triples of each gold AMR, in file order
+        results: per sentence, {(test AMR hash, settings): (best_match_num, test_triple_num, gold_triple_num)}
+            for the test AMRs of the last two runs
+        last_keys: per sentence, the (test AMR hash, settings) scored by the last run
+
+    """
+    def __init__(self, gold_filepath, size=None, mtime=None):
+        self.gold_filepath = gold_filepath
+        self.size = size
+        self.mtime = mtime
+        self.gold_triples = []
+        self.results = []
+        self.last_keys = []
+
+    @staticmethod
+    def cache_path(gold_filepath):
+        return gold_filepath + SENTENCE_CACHE_SUFFIX
+
+    @classmethod
+    def load(cls, gold_filepath):
+        """Load the cache of a gold file; a missing or stale cache is rebuilt from the gold file"""
+        stat = os.stat(gold_filepath)
+        try:
+            with open(cls.cache_path(gold_filepath), "rb") as cache_file:
+                saved = marshal.load(cache_file)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            saved = None
+        if isinstance(saved, dict) and saved.get("version") == SENTENCE_CACHE_VERSION and \
+                saved.get("size") == stat.st_size and saved.get("mtime") == stat.st_mtime:
+            cache = cls(gold_filepath, stat.st_size, stat.st_mtime)
+            cache.gold_triples = saved["gold_triples"]
+            cache.results = saved["results"]
+            cache.last_keys = saved["last_keys"]
+            return cache
+        cache = cls(gold_filepath, stat.st_size, stat.st_mtime)
+        with open(gold_filepath) as gold_file:
+            while True:
+                cur_amr = get_amr_line(gold_file)
+                if cur_amr == "":
+                    break
+                cache.gold_triples.append(amr_triples(cur_amr, "b"))
+        cache.results = [{} for _ in cache.gold_triples]
+        cache.last_keys = [None] * len(cache.gold_triples)
+        return cache
+
+    def save(self):
+        """Write the cache; a read-only gold directory is not an error"""
+        saved = {
+            "version": SENTENCE_CACHE_VERSION,
+            "size": self.size,
+            "mtime": self.mtime,
+            "gold_triples": self.gold_triples,
+            "results": self.results,
+            "last_keys": self.last_keys,
+        }
+        path = self.cache_path(self.gold_filepath)
+        try:
+            with open(path + ".tmp", "wb") as cache_file:
+                marshal.dump(saved, cache_file)
+            os.replace(path + ".tmp", path)
+        except (IOError, OSError) as e:
+            print("Could not save smatch sentence cache: %s" % e, file=ERROR_LOG)
+
+
+def score_with_sentence_cache(test_file, gold_filepath, jobs=1, iteration_count=None,
+                              engine_name=None, seed=None, exact_nodes=None, stats=None):
+    """
+    Score the AMRs of an open test file against a gold file, reusing the SentenceCache of the
+    gold file: unchanged sentences take their saved score, the others are matched against the
+    saved gold triples. The cache is updated with the new scores.
+    Without a seed the scores are random, so they are neither reused nor saved; only the gold
+    triples are.
+    Arguments:
+        test_file: open file of test AMRs
+        gold_filepath: path of the gold AMR file
+        jobs, iteration_count, engine_name, seed, exact_nodes, stats: see score_amr_pairs
+    Returns:
+        results: (best_match_num, test_triple_num, gold_triple_num) of each sentence, in order
+        changes: (sentence number, previous result, new result) of each sentence whose test AMR
+            differs from the one scored by the previous run (none without a seed)
+        rescored: number of sentences that had to be matched
+
+    """
+    if iteration_count is None:
+        iteration_count = iteration_num
+    if exact_nodes is None:
+        exact_nodes = exact_max_nodes
+    cache = SentenceCache.load(gold_filepath)
+    if seed is None:
+        print("Warning: sentence scores are only cached with a random seed (--seed)", file=ERROR_LOG)
+    # everything the score of a sentence depends on, besides its two AMRs
+    settings = (iteration_count, seed, exact_nodes, exact_max_steps)
+    keys = []
+    todo = []
+    while True:
+        cur_amr1 = get_amr_line(test_file)
+        if cur_amr1 == "":
+            break
+        if len(keys) == len(cache.gold_triples):
+            print("Error: File 2 has less AMRs than file 1", file=ERROR_LOG)
+            print("Ignoring remaining AMRs", file=ERROR_LOG)
+            break
+        key = (hashlib.sha1(cur_amr1.encode("utf-8")).hexdigest(), settings)
+        keys.append(key)
+        if seed is None or key not in cache.results[len(keys) - 1]:
+            todo.append((cur_amr1, None, len(keys), cache.gold_triples[len(keys) - 1]))
+    if len(keys) < len(cache.gold_triples):
+        print("Error: File 1 has less AMRs than file 2", file=ERROR_LOG)
+        print("Ignoring remaining AMRs", file=ERROR_LOG)
+    new_results = {}
+    for (cur_amr1, _, sent_num, _), result in zip(todo, score_amr_pairs(
+            todo, jobs, iteration_count, engine_name, seed, exact_nodes, stats=stats)):
+        new_results[sent_num - 1] = result
+    if seed is None:
+        cache.save()
+        return [new_results[i] for i in range(len(keys))], [], len(todo)
+    results = []
+    changes = []
+    for i, key in enumerate(keys):
+        result = new_results[i] if i in new_results else cache.results[i][key]
+        results.append(result)
+        last_key = cache.last_keys[i]
+        if last_key is not None and last_key != key and last_key in cache.results[i]:
+            changes.append((i + 1, cache.results[i][last_key], result))
+        # keep the results of this run and the last one only
+        kept = {key: result}
+        if last_key is not None and last_key in cache.results[i]:
+            kept[last_key] = cache.results[i][last_key]
+        cache.results[i] = kept
+        cache.last_keys[i] = key
+    cache.save()
+    return results, changes, len(todo)
+
+
 def main(arguments):
     """
     Main function of smatch score calculation
@@ -698,7 +1551,13 @@ def main(arguments):
     global iteration_num
     global single_score
     global pr_flag
-    global match_triple_dict
+    global engine
+    global random_seed
+    global restart_job_num
+    global restart_min_nodes
+    global exact_max_nodes
+    global exact_max_steps
+    global debug_match
     # set the iteration number
     # total iteration number = restart number + 1
     iteration_num = arguments.r + 1
@@ -708,106 +1567,105 @@ def main(arguments):
         verbose = True
     if arguments.pr:
         pr_flag = True
+    engine = arguments.engine
+    random_seed = arguments.seed
+    restart_job_num = arguments.restart_jobs
+    restart_min_nodes = arguments.restart_min_nodes
+    exact_max_nodes = arguments.exact_max_nodes
+    exact_max_steps = arguments.exact_max_steps
+    debug_match = arguments.debug_match
+    if arguments.bench:
+        pair_num, elapsed = benchmark_pool(arguments.f[0], arguments.f[1])
+        print("compute_pool: %d AMR pairs, %.3f s (%.1f us per pair)" %
+              (pair_num, elapsed, elapsed / max(pair_num, 1) * 1e6))
+        arguments.f[0].close()
+        arguments.f[1].close()
+        return
+    jobs = arguments.jobs
+    if verbose and jobs > 1:
+        # debug output of several workers would be interleaved
+        print("Verbose output is only supported with one job; scoring serially", file=ERROR_LOG)
+        jobs = 1
+    if jobs > 1 and restart_job_num > 1:
+        # pool workers cannot start pools of their own
+        print("--restart-jobs is ignored when --jobs is more than 1", file=ERROR_LOG)
+        restart_job_num = 1
     # matching triple number
     total_match_num = 0
     # triple number in test file
     total_test_num = 0
     # triple number in gold file
     total_gold_num = 0
-    # sentence number
-    sent_num = 1
-    # Read amr pairs from two files
-    while True:
-        cur_amr1 = get_amr_line(args.f[0])
-        cur_amr2 = get_amr_line(args.f[1])
-        if cur_amr1 == "" and cur_amr2 == "":
-            break
-        if cur_amr1 == "":
-            print("Error: File 1 has less AMRs than file 2", file=ERROR_LOG)
-            print("Ignoring remaining AMRs", file=ERROR_LOG)
-            break
-        if cur_amr2 == "":
-            print("Error: File 2 has less AMRs than file 1", file=ERROR_LOG)
-            print("Ignoring remaining AMRs", file=ERROR_LOG)
-            break
-        amr1 = amr.AMR.parse_AMR_line(cur_amr1)
-        amr2 = amr.AMR.parse_AMR_line(cur_amr2)
-        prefix1 = "a"
-        prefix2 = "b"
-        # Rename node to "a1", "a2", .etc
-        amr1.rename_node(prefix1)
-        # Renaming node to "b1", "b2", .etc
-        amr2.rename_node(prefix2)
-        (instance1, attributes1, relation1) = amr1.get_triples()
-        (instance2, attributes2, relation2) = amr2.get_triples()
-        if verbose:
-            # print parse results of two AMRs
-            print("AMR pair", sent_num, file=DEBUG_LOG)
-            print("============================================", file=DEBUG_LOG)
-            print("AMR 1 (one-line):", cur_amr1, file=DEBUG_LOG)
-            print("AMR 2 (one-line):", cur_amr2, file=DEBUG_LOG)
-            print("Instance triples of AMR 1:", len(instance1), file=DEBUG_LOG)
-            print(instance1, file=DEBUG_LOG)
-            print("Attribute triples of AMR 1:", len(attributes1), file=DEBUG_LOG)
-            print(attributes1, file=DEBUG_LOG)
-            print("Relation triples of AMR 1:", len(relation1), file=DEBUG_LOG)
-            print(relation1, file=DEBUG_LOG)
-            print("Instance triples of AMR 2:", len(instance2), file=DEBUG_LOG)
-            print(instance2, file=DEBUG_LOG)
-            print("Attribute triples of AMR 2:", len(attributes2), file=DEBUG_LOG)
-            print(attributes2, file=DEBUG_LOG)
-            print("Relation triples of AMR 2:", len(relation2), file=DEBUG_LOG)
-            print(relation2, file=DEBUG_LOG)
-            (best_mapping, best_match_num) = get_best_match(instance1, attributes1, relation1,
-                                                            instance2, attributes2, relation2,
-                                                            prefix1, prefix2)
-            if verbose:
-                print("best match number", best_match_num, file=DEBUG_LOG)
-                print("best node mapping", best_mapping, file=DEBUG_LOG)
-                print("Best node mapping alignment:", print_alignment(best_mapping, instance1, instance2), file=DEBUG_LOG)
-            test_triple_num = len(instance1) + len(attributes1) + len(relation1)
-            gold_triple_num = len(instance2) + len(attributes2) + len(relation2)
-            if not single_score:
-                # if each AMR pair should have a score, compute and output it here
-                (precision, recall, best_f_score) = compute_f(best_match_num,
-                                                              test_triple_num,
-                                                              gold_triple_num)
-                #print "Sentence", sent_num
-                if pr_flag:
-                    print("Precision: %.2f" % precision)
-                    print("Recall: %.2f" % recall)
-    #            print "Smatch score: %.2f" % best_f_score
-                print("%.2f" % best_f_score)
-            total_match_num += best_match_num
-            total_test_num += test_triple_num
-            total_gold_num += gold_triple_num
-            # clear the matching triple dictionary for the next AMR pair
-            match_triple_dict.clear()
-            sent_num += 1
-        if verbose:
-            print("Total match number, total triple number in AMR 1, and total triple number in AMR 2:", file=DEBUG_LOG)
-            print(total_match_num, total_test_num, total_gold_num, file=DEBUG_LOG)
-            print("---------------------------------------------------------------------------------", file=DEBUG_LOG)
-        # output document-level smatch score (a single f-score for all AMR pairs in two files)
-        if single_score:
-            (precision, recall, best_f_score) = compute_f(total_match_num, total_test_num, total_gold_num)
+    # hill-climbing statistics of all pairs
+    stats = {}
+    # per-sentence changes since the last run, with --sentence-cache
+    changes = None
+    if arguments.sentence_cache:
+        (results, changes, rescored) = score_with_sentence_cache(
+            arguments.f[0], arguments.f[1].name, jobs, iteration_num, engine, random_seed,
+            exact_max_nodes, stats)
+        print("Sentences rescored: %d of %d" % (rescored, len(results)), file=DEBUG_LOG)
+    else:
+        # Read amr pairs from two files
+        amr_pairs = iter_amr_pairs(arguments.f[0], arguments.f[1])
+        results = score_amr_pairs(amr_pairs, jobs, iteration_num, engine, random_seed,
+                                  exact_max_nodes, stats=stats)
+    for (best_match_num, test_triple_num, gold_triple_num) in results:
+        if not single_score:
+            # if each AMR pair should have a score, compute and output it here
+            (precision, recall, best_f_score) = compute_f(best_match_num,
+                                                          test_triple_num,
+                                                          gold_triple_num)
+            #print "Sentence", sent_num
             if pr_flag:
                 print("Precision: %.2f" % precision)
                 print("Recall: %.2f" % recall)
+            print("%.2f" % best_f_score)
+        total_match_num += best_match_num
+        total_test_num += test_triple_num
+        total_gold_num += gold_triple_num
+    if verbose:
+        print("Total match number, total triple number in AMR 1, and total triple number in AMR 2:", file=DEBUG_LOG)
+        print(total_match_num, total_test_num, total_gold_num, file=DEBUG_LOG)
+        print("---------------------------------------------------------------------------------", file=DEBUG_LOG)
+    # output document-level smatch score (a single f-score for all AMR pairs in two files)
+    if single_score:
+        (precision, recall, best_f_score) = compute_f(total_match_num, total_test_num, total_gold_num)
+        if pr_flag:
+            print("Precision: %.2f" % precision)
+            print("Recall: %.2f" % recall)
         print("Document F-score: %.2f, %.4f" % (best_f_score, best_f_score))
-    args.f[0].close()
-    args.f[1].close()
+    if changes:
+        # document score of the last run: swap the changed sentences back
+        last_totals = [total_match_num, total_test_num, total_gold_num]
+        for (sent_num, last_result, result) in changes:
+            for k in range(3):
+                last_totals[k] += last_result[k] - result[k]
+        last_f_score = compute_f(*last_totals)[2]
+        f_score = compute_f(total_match_num, total_test_num, total_gold_num)[2]
+        print("Document F-score change since the last run: %.4f -> %.4f (%+.4f)" %
+              (last_f_score, f_score, f_score - last_f_score))
+        print("Changed sentences: %d" % len(changes))
+        for (sent_num, last_result, result) in changes:
+            last_f_score = compute_f(*last_result)[2]
+            f_score = compute_f(*result)[2]
+            print("Sentence %d: %.4f -> %.4f (%+.4f)" % (sent_num, last_f_score, f_score,
+                                                         f_score - last_f_score))
+    if arguments.stats or verbose:
+        print("Hill-climbing restarts run: %d, skipped at the match upper bound: %d" %
+              (stats.get("restarts", 0), stats.get("skipped_restarts", 0)), file=DEBUG_LOG)
+    arguments.f[0].close()
+    arguments.f[1].close()
 
 if __name__ == "__main__":
     parser = None
     args = None
     # only support python version 2.5 or later
-    if sys.version_info[0] != 2 or sys.version_info[1] < 5:
-        print("This script only supports python 2.5 or later.  \
-                            It does not support python 3.x.", file=ERROR_LOG)
+    if sys.version_info[:2] < (2, 5):
+        print("This script only supports python 2.5 or later.", file=ERROR_LOG)
         exit(1)
     # use optparse if python version is 2.5 or 2.6
-    if sys.version_info[1] < 7:
+    if sys.version_info[:2] < (2, 7):
         import optparse
         if len(sys.argv) == 1:
             print("No argument given. Please run smatch.py -h \
@@ -0,0 +1,69 @@
+"""Regression check of extract_name_edges in amr_ne_checker.py
+
+extract_name_edges reads the named entities of an AMR straight from its
+text. For every AMR in the given files it must give the same (NE tag, name
+strings, entity variable, name variable) tuples, in the same order, as
+graph_name_edges on the graph built by AMR.parse_AMR_line, and on the one
+built by AMR.parse_AMR_line_fast (which the gold AMR cache stores).
+
+Run from the repository root:
+
+python check_name_edges.py              # all the files in data/
+python check_name_edges.py FILE [FILE ...]
+
+Exits with status 1 if any AMR differs.
+"""
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import os
+import sys
+
+from amr_ne_checker import DATA_DIR, extract_name_edges, graph_name_edges
+from amr import AMR
+from amr_corpus import iter_amrz_mapped
+
+def check_file(amr_file):
+    """Compare extract_name_edges with graph_name_edges on every AMR of a
+    file that AMR.parse_AMR_line accepts
+    Inputs:
+        amr_file: AMR file
+    Returns:
+        (AMRs compared, AMRs not parsed, ids or positions of the AMRs that
+        differ)
+    """
+    compared = 0
+    skipped = 0
+    differ = list()
+    for i, (comment, amr) in enumerate(iter_amrz_mapped(amr_file)):
+        amr_graph = AMR.parse_AMR_line(amr)
+        if amr_graph is None:
+            skipped += 1
+            continue
+        compared += 1
+        entities = extract_name_edges(amr)
+        if entities != graph_name_edges(amr_graph) or \
+                entities != graph_name_edges(AMR.parse_AMR_line_fast(amr)):
+            differ.append(comment.get("id") or str(i + 1))
+    return compared, skipped, differ
+
+if __name__ == "__main__":
+
+    opt = argparse.ArgumentParser(
+        description="Check that extract_name_edges gives the same named "
+                    "entities as graph_name_edges on the parsed AMR")
+    opt.add_argument("files", nargs="*",
+                     help="AMR files (Default: the .amr and .parsed files in data/)")
+    args = opt.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(DATA_DIR, "*.amr")) +
+                                 glob.glob(os.path.join(DATA_DIR, "*.parsed")))
+    failed = False
+    for amr_file in files:
+        compared, skipped, differ = check_file(amr_file)
+        print("%s: %d AMRs, %d not parsed, %d differ" %
+              (os.path.basename(amr_file), compared, skipped, len(differ)))
+        for amr_id in differ:
+            print("  %s" % amr_id)
+        failed = failed or bool(differ)
+    sys.exit(1 if failed else 0)